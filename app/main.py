@@ -3,6 +3,7 @@ from __future__ import annotations
 import json
 import sys
 from dataclasses import asdict
+from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
@@ -13,7 +14,16 @@ from PIL import Image
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
-from src.generation.generate import ALLOWED_RESOLUTIONS, ResolutionError, generate_batch
+from src.generation.generate import (
+    ALLOWED_RESOLUTIONS,
+    LATENT_CAPTURE_MODES,
+    ResolutionError,
+    generate_batch,
+    iter_generate,
+)
+from src.generation.residency import get_residency_manager
+from src.generation.verify import compare_images, reproduce
+from src.metrics.profiling import profiling_enabled
 from src.presets import (
     StylePreset,
     build_negative_prompt,
@@ -21,13 +31,24 @@ from src.presets import (
     get_preset,
     list_presets,
 )
+from src.presets.embeddings import PresetComposition
 from src.storage.store import (
     GenerationRecord,
-    list_generations,
     load_image,
+    load_metadata,
     record_to_dict,
     save_generation,
 )
+from src.storage.export import EXPORT_FORMATS, export_archive, import_archive
+from src.storage.index import GalleryIndex, compare_records, record_key
+from src.storage.latents import latent_store_size, load_latents
+from src.storage.watcher import GalleryWatcher
+
+
+EXPORT_ROOT = Path("exports")
+
+# Gallery sort label -> GalleryIndex metric (None keeps newest first).
+SORT_OPTIONS = {"Newest": None, "Sharpness": "sharpness", "Colorfulness": "colorfulness"}
 
 
 st.set_page_config(
@@ -87,6 +108,27 @@ def sidebar_controls() -> Dict[str, Any]:
 
     st.session_state.selected_preset_id = selected_preset_id
 
+    capture_latents = st.sidebar.selectbox(
+        "Save latents",
+        options=list(LATENT_CAPTURE_MODES),
+        index=0,
+        help="Store denoised latents next to each image so it can be varied without starting from noise.",
+    )
+
+    fast_presets = st.sidebar.checkbox(
+        "Fast preset encoding",
+        value=False,
+        help="Reuse precomputed embeddings for the preset part of the prompt instead of re-encoding it.",
+    )
+
+    profile = st.sidebar.checkbox(
+        "Profile generation",
+        value=profiling_enabled(),
+        help="Record a torch.profiler trace and Python flamegraph for each image (slower).",
+    )
+
+    _memory_panel()
+
     return {
         "model_id": model_id,
         "steps": steps,
@@ -96,9 +138,27 @@ def sidebar_controls() -> Dict[str, Any]:
         "width": width,
         "seed": seed,
         "selected_preset_id": selected_preset_id,
+        "fast_presets": fast_presets,
+        "capture_latents": capture_latents,
+        "profile": profile,
     }
 
 
+def _memory_panel() -> None:
+    report = get_residency_manager().report()
+    with st.sidebar.expander("Memory", expanded=False):
+        if not report:
+            st.write("No models loaded.")
+            return
+        for model_id, components in report.items():
+            st.markdown(f"**{model_id}**")
+            rows = [
+                {"component": name, **{dev: f"{n / 2**20:.0f} MB" for dev, n in per_device.items()}}
+                for name, per_device in components.items()
+            ]
+            st.table(rows)
+
+
 def prompt_section(settings: Dict[str, Any]) -> Dict[str, Any]:
     st.markdown("## Prompt")
 
@@ -148,9 +208,22 @@ def _do_generate(
     try:
         status_placeholder = st.empty()
         status_placeholder.info("⏳ Loading model and generating... This may take 2-5 minutes on first run (downloading ~4GB model). Subsequent runs will be faster.")
-        
+
+        preset_composition = None
+        if settings["fast_presets"] and settings["selected_preset_id"]:
+            preset_composition = PresetComposition(
+                preset_id=settings["selected_preset_id"],
+                base_prompt=prompt_info["base_prompt"],
+                base_negative=prompt_info["base_negative"],
+            )
+
+        preview_cols = st.columns(settings["batch_size"])
+        last_meta: Dict[str, Any] = {}
+
         with st.spinner("Generating images... This may take 1-3 minutes depending on your hardware."):
-            images, metas = generate_batch(
+            # Persist and show each image as soon as it is ready instead of
+            # waiting for the whole batch.
+            for img, meta in iter_generate(
                 prompt_info["composed_prompt"],
                 negative_prompt=prompt_info["composed_negative"],
                 base_seed=settings["seed"],
@@ -160,19 +233,33 @@ def _do_generate(
                 height=settings["height"],
                 width=settings["width"],
                 model_id=settings["model_id"],
-            )
-        
-        status_placeholder.empty()
+                preset_composition=preset_composition,
+                capture_latents=settings["capture_latents"],
+                profile=settings["profile"],
+            ):
+                rec = save_generation(
+                    img,
+                    metadata=meta,
+                    preset_id=settings["selected_preset_id"],
+                )
+                records.append(rec)
+                last_meta = meta
+
+                with preview_cols[meta["variation_index"]]:
+                    st.image(img, use_column_width=True)
+                    st.caption(f"Seed: {rec.seed} | {meta['batch_elapsed_sec']:.1f}s")
+
+                status_placeholder.info(
+                    f"Generated {len(records)}/{settings['batch_size']} image(s)..."
+                )
 
-        for img, meta in zip(images, metas):
-            rec = save_generation(
-                img,
-                metadata=meta,
-                preset_id=settings["selected_preset_id"],
-            )
-            records.append(rec)
+        status_placeholder.empty()
 
-        st.success(f"Generated {len(records)} image(s).")
+        st.success(
+            f"Generated {len(records)} image(s). "
+            f"Time to first image: {last_meta['time_to_first_image_sec']:.1f}s | "
+            f"Total: {last_meta['batch_elapsed_sec']:.1f}s"
+        )
         st.session_state.model_loaded = True  # Mark model as loaded after first success
     except ResolutionError as e:
         st.error(str(e))
@@ -193,6 +280,7 @@ def _gallery_filters() -> Dict[str, Any]:
 
     selected_label = st.selectbox("Preset", options=preset_labels, index=0)
     keyword = st.text_input("Prompt keyword", value=st.session_state.gallery_filter_keyword)
+    sort_label = st.selectbox("Sort by", options=list(SORT_OPTIONS), index=0)
 
     if selected_label == "All":
         preset_id = None
@@ -202,18 +290,114 @@ def _gallery_filters() -> Dict[str, Any]:
     st.session_state.gallery_filter_preset = preset_id
     st.session_state.gallery_filter_keyword = keyword
 
-    return {"preset_id": preset_id, "keyword": keyword}
+    return {"preset_id": preset_id, "keyword": keyword, "sort": SORT_OPTIONS[sort_label]}
+
+
+def _export_panel(records: List[GenerationRecord]) -> None:
+    with st.expander("Export / import", expanded=False):
+        fmt = st.selectbox("Archive format", options=list(EXPORT_FORMATS), index=0)
+        if st.button(f"Export {len(records)} filtered record(s)"):
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            dest = EXPORT_ROOT / (f"gallery-{stamp}" + ("" if fmt == "wds" else f".{fmt}"))
+            try:
+                with st.spinner("Exporting..."):
+                    result = export_archive(records, dest, fmt=fmt)
+                st.success(
+                    f"Exported {result.records} record(s), {result.bytes / 2**20:.1f} MB to {dest}"
+                )
+                if fmt != "wds":
+                    with open(dest, "rb") as f:
+                        st.download_button(
+                            "Download archive",
+                            data=f,
+                            file_name=dest.name,
+                            mime="application/zip" if fmt == "zip" else "application/x-tar",
+                        )
+            except Exception as e:  # noqa: BLE001
+                st.error(f"Export failed: {e}")
+
+        import_path = st.text_input("Archive to import (zip, tar or shard directory)")
+        if import_path and st.button("Import archive"):
+            try:
+                with st.spinner("Importing..."):
+                    result = import_archive(Path(import_path))
+                st.success(f"Imported {result.imported} record(s), skipped {result.skipped} already present.")
+                for failure in result.failed:
+                    st.warning(failure)
+            except Exception as e:  # noqa: BLE001
+                st.error(f"Import failed: {e}")
+
+
+@st.cache_resource
+def _gallery_watcher() -> GalleryWatcher:
+    # One watcher per server process; picks up writes from CLI jobs and other workers.
+    watcher = GalleryWatcher()
+    watcher.start()
+    return watcher
+
+
+@st.cache_resource
+def _gallery_index() -> GalleryIndex:
+    # Indexes the gallery once, then follows the watcher's change events.
+    index = GalleryIndex()
+    index.attach(_gallery_watcher())
+    return index
+
+
+def _duplicates_panel(index: GalleryIndex, records: List[GenerationRecord]) -> None:
+    with st.expander("Near-duplicates", expanded=False):
+        max_distance = st.slider("Max hash distance (bits)", min_value=0, max_value=16, value=6)
+        if not st.button("Find near-duplicates"):
+            return
+        by_key = {record_key(r): r for r in records}
+        groups = index.near_duplicates(max_distance=max_distance)
+        if not groups:
+            st.info("No near-duplicates found.")
+            return
+        st.caption(f"{len(groups)} group(s) of near-identical images.")
+        for group in groups:
+            members = [by_key[k] for k in group if k in by_key]
+            if not members:
+                continue
+            cols = st.columns(min(len(members), 6))
+            for col, rec in zip(cols, members):
+                with col:
+                    st.image(str(rec.image_path), caption=record_key(rec), use_column_width=True)
 
 
 def gallery_section() -> None:
     st.markdown("## Gallery")
 
     filters = _gallery_filters()
-    records = list_generations(
+    watcher = _gallery_watcher()
+    # Cheap when nothing changed; makes images saved in this run visible right away.
+    watcher.poll()
+    records = watcher.list_generations(
         preset_id=filters["preset_id"],
         keyword=filters["keyword"],
     )
 
+    orphans = watcher.orphans()
+    if orphans:
+        count = sum(len(stems) for stems in orphans.values())
+        st.caption(f"{count} incomplete PNG/JSON pair(s) in outputs/ are hidden.")
+
+    latent_count, latent_bytes = latent_store_size()
+    if latent_count:
+        st.caption(f"Latent store: {latent_count} file(s), {latent_bytes / 2**20:.1f} MB")
+
+    index = _gallery_index()
+    try:
+        # Applies only what changed since the last rerun.
+        index.flush()
+        if filters["sort"]:
+            records = index.sort(records, filters["sort"])
+    except Exception as e:  # noqa: BLE001
+        st.warning(f"Gallery index unavailable: {e}")
+
+    _export_panel(records)
+    _duplicates_panel(index, records)
+
     if not records:
         st.info("No generations yet. Generate something to see it here.")
         return
@@ -246,7 +430,7 @@ def gallery_section() -> None:
                     st.session_state.compare_selection.remove(rec.id)
 
     detail_view(records)
-    compare_view(records)
+    compare_view(records, index)
 
 
 def _find_record(records: List[GenerationRecord], rec_id: str) -> Optional[GenerationRecord]:
@@ -282,8 +466,7 @@ def detail_view(records: List[GenerationRecord]) -> None:
 
         # Export buttons: JSON sidecar and PNG download
         if st.button("Export JSON metadata", key=f"export_json_{rec.id}"):
-            with open(rec.metadata_path, "r", encoding="utf-8") as f:  # type: ignore[arg-type]
-                data = f.read()
+            data = json.dumps(load_metadata(rec), indent=2)
             st.download_button(
                 "Download metadata JSON",
                 data=data,
@@ -292,11 +475,10 @@ def detail_view(records: List[GenerationRecord]) -> None:
             )
 
         try:
-            img = load_image(rec)
-            img_bytes = _image_to_bytes(img)
+            # Serve the stored file as-is; decoding and re-encoding it adds nothing.
             st.download_button(
                 "Download PNG",
-                data=img_bytes,
+                data=Path(rec.image_path).read_bytes(),
                 file_name=f"{rec.id}.png",
                 mime="image/png",
             )
@@ -306,58 +488,115 @@ def detail_view(records: List[GenerationRecord]) -> None:
         if st.button("Reproduce", key=f"reproduce_{rec.id}"):
             _reproduce_from_record(rec)
 
-
-def _image_to_bytes(img: Image.Image) -> bytes:
-    from io import BytesIO
-
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    return buf.getvalue()
+        _profile_panel(rec)
+
+        if rec.latent_path and Path(rec.latent_path).exists():
+            st.markdown("### Vary")
+            st.caption(f"Stored latents: {Path(rec.latent_path).stat().st_size / 1024:.0f} KB")
+            strength = st.slider(
+                "Variation strength",
+                min_value=0.1,
+                max_value=1.0,
+                value=0.6,
+                step=0.05,
+                key=f"vary_strength_{rec.id}",
+                help="Fraction of the steps re-run from the stored latents. Lower stays closer to the original.",
+            )
+            if st.button("Vary from latents", key=f"vary_{rec.id}"):
+                _vary_from_record(rec, strength)
 
 
 def _reproduce_from_record(rec: GenerationRecord) -> None:
-    """Re-run generation with the exact parameters used for this record."""
+    """Re-run generation with the exact parameters used for this record and compare."""
 
     try:
-        with open(rec.metadata_path, "r", encoding="utf-8") as f:  # type: ignore[arg-type]
-            meta = json.load(f)
+        meta = load_metadata(rec)
     except Exception as e:  # noqa: BLE001
         st.error(f"Failed to load metadata for reproduction: {e}")
         return
 
-    prompt = meta.get("prompt", "")
-    negative_prompt = meta.get("negative_prompt") or ""
-    base_seed = int(meta.get("base_seed") or meta.get("seed") or 0)
-    steps = int(meta.get("steps", 30))
-    guidance = float(meta.get("guidance_scale", 7.5))
-    height = int(meta.get("height", 512))
-    width = int(meta.get("width", 512))
-    model_id = meta.get("model_id", "runwayml/stable-diffusion-v1-5")
-
     try:
         with st.spinner("Reproducing image..."):
+            img, new_meta = reproduce(meta)
+        new_rec = save_generation(img, metadata=new_meta, preset_id=rec.preset_id)
+
+        with Image.open(rec.image_path) as original:
+            comparison = compare_images(original, img)
+        if comparison["status"] == "exact":
+            st.success("Reproduction complete: pixel-identical to the original.")
+        else:
+            details = f"pHash distance {comparison.get('phash_distance')}, SSIM {comparison.get('ssim', 0.0):.4f}"
+            if comparison["status"] == "close":
+                st.info(f"Reproduction complete: visually identical ({details}).")
+            else:
+                st.warning(f"Reproduction differs from the original ({details}).")
+        st.session_state.selected_record_id = new_rec.id
+    except Exception as e:  # noqa: BLE001
+        st.error(f"Reproduction failed: {e}")
+
+
+def _profile_panel(rec: GenerationRecord) -> None:
+    try:
+        profile = load_metadata(rec).get("profile")
+    except Exception:  # noqa: BLE001
+        return
+    if not profile:
+        return
+
+    st.markdown("### Profile")
+    st.table([{"stage": name, "seconds": f"{sec:.3f}"} for name, sec in profile.get("stages", {}).items()])
+
+    downloads = [
+        ("trace", "Download Chrome trace", "application/gzip", "Open in chrome://tracing or ui.perfetto.dev"),
+        ("stacks", "Download flamegraph stacks", "text/plain", "Folded stacks for speedscope or flamegraph.pl"),
+    ]
+    for key, label, mime, help_text in downloads:
+        path = profile.get(key)
+        if path and Path(path).exists():
+            st.download_button(
+                label,
+                data=Path(path).read_bytes(),
+                file_name=Path(path).name,
+                mime=mime,
+                help=help_text,
+                key=f"profile_{key}_{rec.id}",
+            )
+
+
+def _vary_from_record(rec: GenerationRecord, strength: float) -> None:
+    """Denoise again from the record's stored final latents with a new seed."""
+
+    try:
+        meta = load_metadata(rec)
+        init_latents = load_latents(Path(rec.latent_path))  # type: ignore[arg-type]
+    except Exception as e:  # noqa: BLE001
+        st.error(f"Failed to load latents for variation: {e}")
+        return
+
+    try:
+        with st.spinner("Generating variation..."):
             images, metas = generate_batch(
-                prompt,
-                negative_prompt=negative_prompt,
-                base_seed=base_seed,
+                meta.get("prompt", ""),
+                negative_prompt=meta.get("negative_prompt") or "",
+                base_seed=int(meta.get("seed", 0)) + 1,
                 num_images=1,
-                num_inference_steps=steps,
-                guidance_scale=guidance,
-                height=height,
-                width=width,
-                model_id=model_id,
+                num_inference_steps=int(meta.get("steps", 30)),
+                guidance_scale=float(meta.get("guidance_scale", 7.5)),
+                model_id=meta.get("model_id", "runwayml/stable-diffusion-v1-5"),
+                capture_latents="final",
+                init_latents=init_latents,
+                strength=strength,
             )
-        img = images[0]
-        new_meta = metas[0]
-        new_rec = save_generation(img, metadata=new_meta, preset_id=rec.preset_id)
+        new_meta = {**metas[0], "source_record_id": rec.id, "init_latent_path": rec.latent_path}
+        new_rec = save_generation(images[0], metadata=new_meta, preset_id=rec.preset_id)
 
-        st.success("Reproduction complete. New record added to gallery.")
+        st.success("Variation complete. New record added to gallery.")
         st.session_state.selected_record_id = new_rec.id
     except Exception as e:  # noqa: BLE001
-        st.error(f"Reproduction failed: {e}")
+        st.error(f"Variation failed: {e}")
 
 
-def compare_view(records: List[GenerationRecord]) -> None:
+def compare_view(records: List[GenerationRecord], index: GalleryIndex) -> None:
     sel_ids: List[str] = st.session_state.compare_selection
     if not sel_ids:
         return
@@ -369,6 +608,15 @@ def compare_view(records: List[GenerationRecord]) -> None:
     st.markdown("---")
     st.markdown("## Compare")
 
+    # Similarity of each selected image to the first one.
+    similarity: Dict[str, Dict[str, float]] = {}
+    stats: Dict[str, Dict[str, float]] = {}
+    try:
+        similarity = {row["id"]: row for row in compare_records(selected_records)}
+        stats = index.metrics(selected_records)
+    except Exception as e:  # noqa: BLE001
+        st.warning(f"Could not compute image metrics: {e}")
+
     cols = st.columns(len(selected_records))
     for col, rec in zip(cols, selected_records):
         with col:
@@ -380,6 +628,11 @@ def compare_view(records: List[GenerationRecord]) -> None:
                 st.write("(image missing)")
 
             st.caption(f"Seed: {rec.seed} | Preset: {rec.preset_id or 'None'}")
+            if rec.id in similarity:
+                row = similarity[rec.id]
+                st.caption(f"vs {selected_records[0].id}: SSIM {row['ssim']:.3f} | PSNR {row['psnr']:.1f} dB")
+            if rec.id in stats:
+                st.caption(" | ".join(f"{k}: {v:.1f}" for k, v in stats[rec.id].items()))
 
             st.json(
                 {
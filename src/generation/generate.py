@@ -1,12 +1,24 @@
 from __future__ import annotations
 
+import asyncio
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from dataclasses import asdict
+from functools import lru_cache
 from time import perf_counter
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
 
+import diffusers
+import numpy as np
 import torch
+import transformers
+from diffusers import StableDiffusionImg2ImgPipeline, StableDiffusionPipeline
 
+from ..metrics.profiling import GenerationProfiler, profiling_enabled
+from ..presets.embeddings import PresetComposition, get_preset_bank
 from .pipeline import SDConfig, SDMPSPipeline
+from .residency import get_residency_manager
 
 
 Resolution = Tuple[int, int]
@@ -19,6 +31,9 @@ ALLOWED_RESOLUTIONS: List[Resolution] = [
 ]
 
 
+LATENT_CAPTURE_MODES = ("none", "final", "all")
+
+
 class ResolutionError(ValueError):
     pass
 
@@ -31,15 +46,69 @@ def validate_resolution(height: int, width: int) -> None:
         )
 
 
-def _build_pipeline(base_config: SDConfig) -> SDMPSPipeline:
+def _build_pipeline(base_config: SDConfig, dtype: Optional[str] = None) -> ContextManager[SDMPSPipeline]:
     # Guardrail: avoid float64 issues on MPS by ensuring default dtypes are safe.
     torch.set_default_dtype(torch.float32)
 
-    pipe_wrapper = SDMPSPipeline(config=base_config)
-    return pipe_wrapper
+    # Reuse resident pipelines; the manager evicts/offloads to stay within budget,
+    # but not while this run holds the pipeline.
+    return get_residency_manager().pinned(base_config, dtype=getattr(torch, dtype) if dtype else None)
 
 
-def generate_batch(
+@lru_cache(maxsize=None)
+def library_versions() -> Dict[str, str]:
+    """Versions that can change generated pixels; stored with every record."""
+
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "diffusers": diffusers.__version__,
+        "transformers": transformers.__version__,
+    }
+
+
+def _scheduler_from_config(scheduler_config: Dict[str, Any]) -> Any:
+    cls = getattr(diffusers, scheduler_config["_class_name"])
+    return cls.from_config(scheduler_config)
+
+
+def _check_request(num_images: int, height: int, width: int) -> None:
+    if num_images < 1:
+        raise ValueError("num_images must be >= 1")
+
+    validate_resolution(height, width)
+
+
+def _latent_recorder(mode: str) -> Tuple[Optional[Callable[..., Dict[str, Any]]], Dict[str, Any]]:
+    """Build a ``callback_on_step_end`` that keeps latents according to ``mode``.
+
+    The returned dict is filled during the run with name -> latents; call
+    :func:`_latents_to_numpy` on it afterwards.
+    """
+
+    if mode not in LATENT_CAPTURE_MODES:
+        raise ValueError(f"Unknown latent capture mode {mode!r}. Allowed: {', '.join(LATENT_CAPTURE_MODES)}")
+
+    captured: Dict[str, Any] = {}
+    if mode == "none":
+        return None, captured
+
+    def _on_step_end(pipe: Any, step: int, timestep: Any, callback_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        latents = callback_kwargs["latents"]
+        # The scheduler returns a new tensor every step, so keeping a reference is safe.
+        captured["final"] = latents
+        if mode == "all":
+            captured[f"step_{step:04d}"] = latents.detach().to("cpu", torch.float16)
+        return callback_kwargs
+
+    return _on_step_end, captured
+
+
+def _latents_to_numpy(captured: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    return {name: t[0].detach().to("cpu", torch.float16).numpy() for name, t in captured.items()}
+
+
+def iter_generate(
     prompt: str,
     *,
     negative_prompt: Optional[str] = None,
@@ -50,18 +119,56 @@ def generate_batch(
     height: int = 512,
     width: int = 512,
     model_id: str = "runwayml/stable-diffusion-v1-5",
-) -> Tuple[List[Any], List[Dict[str, Any]]]:
-    """Generate one or more images with deterministic seeding and full metadata.
+    preset_composition: Optional[PresetComposition] = None,
+    capture_latents: str = "none",
+    init_latents: Optional[Any] = None,
+    strength: float = 0.6,
+    profile: Optional[bool] = None,
+    dtype: Optional[str] = None,
+    scheduler_config: Optional[Dict[str, Any]] = None,
+) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    """Yield each (image, metadata) pair as soon as its denoising loop finishes.
 
-    - Same (prompt, negative prompt, seed, steps, guidance, model, resolution) should
-      yield the same outputs as closely as possible.
-    - Batch generation uses sequential seeds: base_seed, base_seed+1, ...
+    Seeding and metadata are identical to :func:`generate_batch`. Each metadata
+    dict additionally carries batch timings measured from the start of the call
+    (so they include pipeline load and warmup):
+
+    - ``batch_elapsed_sec``: time until this image was ready.
+    - ``time_to_first_image_sec``: time until the first image of the batch was ready.
+
+    If ``preset_composition`` describes how ``prompt`` / ``negative_prompt`` were
+    composed, the preset part is taken from the precomputed embedding bank instead
+    of being re-encoded (when that preset passed validation). A composition that
+    does not reproduce the given prompts exactly is ignored and the text is
+    encoded. Metadata records the path used as ``prompt_encoding``.
+
+    ``capture_latents`` (``"final"`` or ``"all"`` steps) adds ``metadata["latents"]``
+    (name -> fp16 array) for :func:`save_generation` to store next to the record.
+
+    Passing ``init_latents`` (e.g. the stored final latents of a record, shaped
+    [4, h/8, w/8]) runs img2img-style denoising from them instead of from pure
+    noise: only ``int(num_inference_steps * strength)`` steps are run, and the
+    output size follows the latents.
+
+    ``profile=True`` (or ``DREAMCANVAS_PROFILE=1`` when ``profile`` is None) runs
+    each image under :class:`GenerationProfiler` and adds ``metadata["profile"]``
+    with a Chrome trace, folded stacks and per-stage timings.
+
+    ``dtype`` (``"float16"`` / ``"float32"``) overrides the device default and
+    ``scheduler_config`` (as stored in a record's metadata) swaps in that
+    scheduler; both are for reproducing records made elsewhere. Metadata always
+    records the dtype, scheduler and library versions used.
     """
 
-    if num_images < 1:
-        raise ValueError("num_images must be >= 1")
+    if init_latents is not None:
+        init_latents = torch.as_tensor(np.asarray(init_latents))
+        if init_latents.ndim == 3:
+            init_latents = init_latents[None]
+        height, width = init_latents.shape[-2] * 8, init_latents.shape[-1] * 8
+        if not 0.0 < strength <= 1.0:
+            raise ValueError("strength must be in (0, 1]")
 
-    validate_resolution(height, width)
+    _check_request(num_images, height, width)
 
     config = SDConfig(
         model_id=model_id,
@@ -72,52 +179,219 @@ def generate_batch(
         seed=base_seed,
     )
 
-    wrapper = _build_pipeline(config)
-    pipe = wrapper.pipe
+    batch_t0 = perf_counter()
+    time_to_first_image: Optional[float] = None
 
-    images: List[Any] = []
-    metadata_list: List[Dict[str, Any]] = []
+    with _build_pipeline(config, dtype) as wrapper:
+        pipe = wrapper.pipe
+
+        # Embeddings are identical for every variation, so encode once per batch.
+        prompt_kwargs: Dict[str, Any] = {"prompt": prompt, "negative_prompt": negative_prompt}
+        prompt_encoding = "text"
+        # The bank encodes the composition, not the prompt text; use it only when
+        # the two agree, e.g. not after the preset was edited since.
+        if preset_composition is not None and preset_composition.describes(prompt, negative_prompt):
+            bank = get_preset_bank(pipe, model_id)
+            if bank.is_usable(preset_composition.preset_id):
+                prompt_embeds, negative_embeds = bank.compose(pipe, preset_composition)
+                prompt_kwargs = {"prompt_embeds": prompt_embeds, "negative_prompt_embeds": negative_embeds}
+                prompt_encoding = "preset_bank"
 
-    for i in range(num_images):
-        # Deterministic seeding per variation.
-        effective_seed = (base_seed or 0) + i
-        generator = torch.Generator(device=wrapper.device).manual_seed(effective_seed)
-
-        t0 = perf_counter()
-        result = pipe(
-            prompt,
-            negative_prompt=negative_prompt,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            height=height,
-            width=width,
-            generator=generator,
+        # Every run gets its own pipeline object and scheduler around the shared,
+        # loaded components: schedulers keep state between steps (timesteps,
+        # PNDM's history), so runs on one model must not share them.
+        components = dict(pipe.components)
+        components["scheduler"] = _scheduler_from_config(
+            scheduler_config if scheduler_config is not None else pipe.scheduler.config
+        )
+        pipeline_cls = StableDiffusionImg2ImgPipeline if init_latents is not None else StableDiffusionPipeline
+        run = pipeline_cls(
+            **components,
+            requires_safety_checker=getattr(pipe.config, "requires_safety_checker", False),
         )
-        duration = perf_counter() - t0
 
-        image = result.images[0]
-        images.append(image)
+        size_kwargs: Dict[str, Any] = {"height": height, "width": width}
+        if init_latents is not None:
+            size_kwargs = {
+                "image": init_latents.to(wrapper.device, wrapper.dtype),
+                "strength": strength,
+            }
+
+        do_profile = profiling_enabled(profile)
+
+        for i in range(num_images):
+            # Deterministic seeding per variation.
+            effective_seed = (base_seed or 0) + i
+            generator = torch.Generator(device=wrapper.device).manual_seed(effective_seed)
+
+            on_step_end, captured = _latent_recorder(capture_latents)
+
+            profiler = GenerationProfiler(run) if do_profile else None
 
-        metadata: Dict[str, Any] = {
-            "prompt": prompt,
-            "negative_prompt": negative_prompt or "",
-            "seed": effective_seed,
-            "base_seed": base_seed,
-            "steps": num_inference_steps,
-            "guidance_scale": guidance_scale,
-            "height": height,
-            "width": width,
-            "model_id": model_id,
-            "duration_sec": duration,
-            "device": str(wrapper.device),
-            "config": asdict(config),
-            "variation_index": i,
-            "num_images": num_images,
-        }
+            t0 = perf_counter()
+            with wrapper.run_lock(), profiler or nullcontext():
+                result = run(
+                    **prompt_kwargs,
+                    **size_kwargs,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                    generator=generator,
+                    callback_on_step_end=on_step_end,
+                )
+            duration = perf_counter() - t0
+            batch_elapsed = perf_counter() - batch_t0
+            if time_to_first_image is None:
+                time_to_first_image = batch_elapsed
+
+            image = result.images[0]
+
+            metadata: Dict[str, Any] = {
+                "prompt": prompt,
+                "negative_prompt": negative_prompt or "",
+                "seed": effective_seed,
+                "base_seed": base_seed,
+                "steps": num_inference_steps,
+                "guidance_scale": guidance_scale,
+                "height": height,
+                "width": width,
+                "model_id": model_id,
+                "duration_sec": duration,
+                "batch_elapsed_sec": batch_elapsed,
+                "time_to_first_image_sec": time_to_first_image,
+                "device": str(wrapper.device),
+                "dtype": str(wrapper.dtype).replace("torch.", ""),
+                "scheduler_config": dict(run.scheduler.config),
+                "versions": library_versions(),
+                "config": asdict(config),
+                "prompt_encoding": prompt_encoding,
+                "variation_index": i,
+                "num_images": num_images,
+            }
+            if prompt_encoding == "preset_bank":
+                metadata["preset_composition"] = asdict(preset_composition)
+            if init_latents is not None:
+                metadata["mode"] = "vary"
+                metadata["strength"] = strength
+                metadata["denoise_steps"] = int(num_inference_steps * strength)
+            if captured:
+                metadata["latents"] = _latents_to_numpy(captured)
+            if profiler is not None:
+                metadata["profile"] = profiler.artifacts()
+
+            yield image, metadata
+
+
+def aiter_generate(
+    prompt: str,
+    **kwargs: Any,
+) -> AsyncIterator[Tuple[Any, Dict[str, Any]]]:
+    """Async variant of :func:`iter_generate`.
+
+    Each denoising run happens in a worker thread so the event loop stays
+    responsive between images. Accepts the same keyword arguments.
+
+    The request is validated when this is called, not at the first ``async for``
+    step. Leaving the loop early (``break``, cancellation) closes the underlying
+    run once the image in progress is done.
+    """
+
+    # With init_latents the size comes from the latents and is checked in iter_generate.
+    if kwargs.get("init_latents") is None:
+        _check_request(
+            kwargs.get("num_images", 1),
+            kwargs.get("height", 512),
+            kwargs.get("width", 512),
+        )
+    return _aiter_run(iter_generate(prompt, **kwargs))
+
+
+async def _aiter_run(it: Iterator[Tuple[Any, Dict[str, Any]]]) -> AsyncIterator[Tuple[Any, Dict[str, Any]]]:
+    loop = asyncio.get_running_loop()
+    done = object()
+    # One thread per run: close() then queues behind an in-flight next() instead
+    # of failing with "generator already executing".
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aiter-generate")
+    try:
+        while True:
+            item = await loop.run_in_executor(pool, next, it, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        try:
+            await loop.run_in_executor(pool, it.close)
+        finally:
+            pool.shutdown(wait=False)
+
+
+def generate_batch(
+    prompt: str,
+    *,
+    negative_prompt: Optional[str] = None,
+    base_seed: Optional[int] = None,
+    num_images: int = 1,
+    num_inference_steps: int = 30,
+    guidance_scale: float = 7.5,
+    height: int = 512,
+    width: int = 512,
+    model_id: str = "runwayml/stable-diffusion-v1-5",
+    preset_composition: Optional[PresetComposition] = None,
+    capture_latents: str = "none",
+    init_latents: Optional[Any] = None,
+    strength: float = 0.6,
+    profile: Optional[bool] = None,
+    dtype: Optional[str] = None,
+    scheduler_config: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Any], List[Dict[str, Any]]]:
+    """Generate one or more images with deterministic seeding and full metadata.
+
+    - Same (prompt, negative prompt, seed, steps, guidance, model, resolution) should
+      yield the same outputs as closely as possible.
+    - Batch generation uses sequential seeds: base_seed, base_seed+1, ...
+
+    Returns once the whole batch is done; use :func:`iter_generate` to consume
+    images as they finish.
+
+    To vary an existing record, pass its stored final latents as ``init_latents``;
+    denoising then starts from them with ``int(num_inference_steps * strength)``
+    steps instead of from pure noise.
+    """
+
+    images: List[Any] = []
+    metadata_list: List[Dict[str, Any]] = []
+
+    for image, metadata in iter_generate(
+        prompt,
+        negative_prompt=negative_prompt,
+        base_seed=base_seed,
+        num_images=num_images,
+        num_inference_steps=num_inference_steps,
+        guidance_scale=guidance_scale,
+        height=height,
+        width=width,
+        model_id=model_id,
+        preset_composition=preset_composition,
+        capture_latents=capture_latents,
+        init_latents=init_latents,
+        strength=strength,
+        profile=profile,
+        dtype=dtype,
+        scheduler_config=scheduler_config,
+    ):
+        images.append(image)
         metadata_list.append(metadata)
 
     return images, metadata_list
 
 
-__all__ = ["generate_batch", "ResolutionError", "validate_resolution", "ALLOWED_RESOLUTIONS"]
+__all__ = [
+    "LATENT_CAPTURE_MODES",
+    "library_versions",
+    "generate_batch",
+    "iter_generate",
+    "aiter_generate",
+    "ResolutionError",
+    "validate_resolution",
+    "ALLOWED_RESOLUTIONS",
+]
 
@@ -0,0 +1,390 @@
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import mmap
+import os
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from typing import Any, Dict, Optional
+
+import torch
+from diffusers import StableDiffusionPipeline
+from safetensors.torch import save_file
+
+
+MODEL_STORE_ROOT = Path("models") / "store"
+
+STORE_FORMAT_VERSION = 1
+
+_MANIFEST_NAME = "store.json"
+_WEIGHTS_NAME = "weights.safetensors"
+
+# safetensors dtype tags -> torch dtypes
+_DTYPES: Dict[str, torch.dtype] = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def _slug(model_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "--", model_id)
+
+
+def _dtype_name(dtype: torch.dtype) -> str:
+    return str(dtype).replace("torch.", "")
+
+
+def store_path(model_id: str, dtype: torch.dtype) -> Path:
+    """Directory holding ``model_id`` converted to ``dtype``."""
+
+    return MODEL_STORE_ROOT / f"{_slug(model_id)}--{_dtype_name(dtype)}"
+
+
+def is_stored(model_id: str, dtype: torch.dtype) -> bool:
+    return (store_path(model_id, dtype) / _MANIFEST_NAME).exists()
+
+
+def stored_bytes(model_id: str, dtype: torch.dtype) -> Optional[int]:
+    """Total weight bytes of a stored model (from its manifest), or None if not stored."""
+
+    path = store_path(model_id, dtype) / _MANIFEST_NAME
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as f:
+        components = json.load(f)["components"]
+    return sum(entry.get("bytes", 0) for entry in components.values() if entry and entry["kind"] == "module")
+
+
+def _class_path(obj: Any) -> str:
+    cls = type(obj)
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def _import_class(path: str) -> type:
+    module_name, _, name = path.rpartition(".")
+    return getattr(importlib.import_module(module_name), name)
+
+
+def _module_tensors(module: torch.nn.Module) -> Dict[str, torch.Tensor]:
+    # Include non-persistent buffers (e.g. CLIP position_ids): the loader builds
+    # modules on the meta device, so anything not stored would stay empty.
+    tensors: Dict[str, torch.Tensor] = {}
+    for name, t in module.named_parameters(remove_duplicate=False):
+        tensors[name] = t
+    for name, t in module.named_buffers(remove_duplicate=False):
+        tensors[name] = t
+    return tensors
+
+
+def save_to_store(pipe: StableDiffusionPipeline, model_id: str, dtype: torch.dtype) -> Path:
+    """Write a loaded pipeline into the store layout.
+
+    Layout: ``<root>/<model>--<dtype>/<component>/weights.safetensors`` (one shard per
+    torch module, already cast to ``dtype``) plus the component configs and a
+    ``store.json`` manifest. The directory is written under a temporary name and
+    renamed at the end so readers never see a half-written store.
+    """
+
+    final_dir = store_path(model_id, dtype)
+    if (final_dir / _MANIFEST_NAME).exists():
+        return final_dir
+
+    tmp_dir = final_dir.with_name(final_dir.name + f".tmp-{os.getpid()}")
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    components: Dict[str, Optional[Dict[str, Any]]] = {}
+    for name, component in pipe.components.items():
+        if component is None:
+            components[name] = None
+            continue
+
+        sub_dir = tmp_dir / name
+        sub_dir.mkdir()
+
+        if not isinstance(component, torch.nn.Module):
+            # Tokenizers, schedulers and feature extractors are small; keep their own format.
+            component.save_pretrained(str(sub_dir))
+            components[name] = {"class": _class_path(component), "kind": "pretrained"}
+            continue
+
+        if hasattr(component, "save_config"):  # diffusers ModelMixin
+            component.save_config(str(sub_dir))
+        else:  # transformers PreTrainedModel
+            component.config.save_pretrained(str(sub_dir))
+
+        tensors: Dict[str, torch.Tensor] = {}
+        aliases: Dict[str, str] = {}
+        seen: Dict[Any, str] = {}
+        for tensor_name, t in _module_tensors(component).items():
+            if t.device.type == "meta":
+                raise ValueError(
+                    f"{name}.{tensor_name} is not materialized (sequential offload?); cannot store it"
+                )
+            # Tied weights are stored once and re-linked on load.
+            key = (t.device, t.data_ptr(), tuple(t.shape), t.dtype)
+            if t.numel() and key in seen:
+                aliases[tensor_name] = seen[key]
+                continue
+            seen[key] = tensor_name
+            if t.is_floating_point():
+                t = t.to(dtype)
+            tensors[tensor_name] = t.detach().to("cpu").contiguous()
+
+        weights_path = sub_dir / _WEIGHTS_NAME
+        save_file(tensors, str(weights_path))
+        components[name] = {
+            "class": _class_path(component),
+            "kind": "module",
+            "file": f"{name}/{_WEIGHTS_NAME}",
+            "bytes": weights_path.stat().st_size,
+            "aliases": aliases,
+        }
+
+    manifest = {
+        "format_version": STORE_FORMAT_VERSION,
+        "model_id": model_id,
+        "dtype": _dtype_name(dtype),
+        "pipeline_class": _class_path(pipe),
+        "requires_safety_checker": bool(getattr(pipe.config, "requires_safety_checker", False)),
+        "components": components,
+    }
+    with (tmp_dir / _MANIFEST_NAME).open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    if final_dir.exists():
+        shutil.rmtree(final_dir)
+    os.replace(tmp_dir, final_dir)
+    return final_dir
+
+
+def convert_to_store(model_id: str, dtype: torch.dtype) -> Path:
+    """Download (or reuse the hub cache for) ``model_id`` and convert it once."""
+
+    if is_stored(model_id, dtype):
+        return store_path(model_id, dtype)
+
+    pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=dtype)
+    return save_to_store(pipe, model_id, dtype)
+
+
+def mmap_safetensors(path: Path) -> Dict[str, torch.Tensor]:
+    """Map a safetensors file and return tensors that view the mapping without copying.
+
+    The mapping is private copy-on-write, so pages come straight from the page cache
+    and are shared by every process that maps the same file until one writes to them.
+    """
+
+    with path.open("rb") as f:
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len))
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_len
+    tensors: Dict[str, torch.Tensor] = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _DTYPES[info["dtype"]]
+        shape = info["shape"]
+        begin, end = info["data_offsets"]
+        if end == begin:
+            tensors[name] = torch.empty(shape, dtype=dtype)
+            continue
+        numel = (end - begin) // torch.tensor([], dtype=dtype).element_size()
+        tensors[name] = torch.frombuffer(buf, dtype=dtype, count=numel, offset=data_start + begin).reshape(shape)
+    return tensors
+
+
+def _assign_tensors(module: torch.nn.Module, tensors: Dict[str, torch.Tensor]) -> None:
+    for name, tensor in tensors.items():
+        owner_name, _, attr = name.rpartition(".")
+        owner = module.get_submodule(owner_name) if owner_name else module
+        if attr in owner._parameters:
+            owner._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            owner._buffers[attr] = tensor
+
+
+def _build_empty_module(cls: type, sub_dir: Path) -> torch.nn.Module:
+    # Construct on the meta device: no allocation, no random init.
+    with torch.device("meta"):
+        if hasattr(cls, "load_config"):  # diffusers ModelMixin
+            return cls.from_config(cls.load_config(str(sub_dir)))
+        config = cls.config_class.from_pretrained(str(sub_dir))
+        return cls(config)
+
+
+def load_from_store(model_id: str, dtype: torch.dtype) -> StableDiffusionPipeline:
+    """Assemble a pipeline whose weights are memory-mapped from the store.
+
+    Weights are used in place on the CPU; moving the pipeline to another device
+    copies them there as usual.
+    """
+
+    root = store_path(model_id, dtype)
+    with (root / _MANIFEST_NAME).open("r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format_version") != STORE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported model store format in {root}; delete it to reconvert")
+
+    components: Dict[str, Any] = {}
+    for name, entry in manifest["components"].items():
+        if entry is None:
+            components[name] = None
+            continue
+
+        cls = _import_class(entry["class"])
+        if entry["kind"] == "pretrained":
+            components[name] = cls.from_pretrained(str(root / name))
+            continue
+
+        module = _build_empty_module(cls, root / name)
+        tensors = mmap_safetensors(root / entry["file"])
+        for alias, target in entry.get("aliases", {}).items():
+            tensors[alias] = tensors[target]
+        _assign_tensors(module, tensors)
+
+        missing = [n for n, t in _module_tensors(module).items() if t.device.type == "meta"]
+        if missing:
+            raise ValueError(f"Model store {root} is missing tensors for {name}: {missing[:5]}")
+
+        components[name] = module.eval()
+
+    pipeline_cls = _import_class(manifest["pipeline_class"])
+    return pipeline_cls(**components, requires_safety_checker=manifest["requires_safety_checker"])
+
+
+# ---------------------------------------------------------------------------
+# Cold-start benchmark
+# ---------------------------------------------------------------------------
+
+
+def _memory_stats() -> Dict[str, int]:
+    """RSS plus anonymous (unshareable) memory of this process, in bytes."""
+
+    stats: Dict[str, int] = {}
+    rollup = Path("/proc/self/smaps_rollup")
+    if rollup.exists():
+        for line in rollup.read_text().splitlines():
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss", "Anonymous"):
+                stats[key.lower()] = int(rest.split()[0]) * 1024
+        return stats
+
+    import resource
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux.
+    stats["rss"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+    return stats
+
+
+def _bench_child(kind: str, model_id: str, dtype_name: str) -> None:
+    dtype = getattr(torch, dtype_name)
+    t0 = perf_counter()
+    if kind == "hub":
+        pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=dtype)
+    else:
+        pipe = load_from_store(model_id, dtype)
+    load_sec = perf_counter() - t0
+
+    # Touch every weight once so lazily mapped pages count as resident.
+    with torch.no_grad():
+        for component in pipe.components.values():
+            if isinstance(component, torch.nn.Module):
+                for p in component.parameters():
+                    p.sum()
+
+    print(json.dumps({"load_sec": load_sec, **_memory_stats()}))
+
+
+def benchmark_cold_start(
+    model_id: str,
+    dtype: torch.dtype = torch.float32,
+    runs: int = 3,
+) -> Dict[str, Dict[str, float]]:
+    """Compare hub ``from_pretrained`` with store loading, each in a fresh process.
+
+    Returns the median of ``load_sec``, ``rss`` and (on Linux) ``anonymous`` bytes per
+    path. Anonymous memory is what each extra worker costs; mapped store pages are
+    shared through the page cache instead.
+    """
+
+    convert_to_store(model_id, dtype)
+
+    results: Dict[str, Dict[str, float]] = {}
+    for kind in ("hub", "store"):
+        samples = []
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, "-m", __name__, "_child", kind, model_id, _dtype_name(dtype)],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        results[kind] = {key: median(s[key] for s in samples) for key in samples[0]}
+    return results
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="DreamCanvas local model store")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    conv = sub.add_parser("convert", help="convert a model into the store")
+    conv.add_argument("model_id")
+    conv.add_argument("--dtype", default="float32")
+
+    bench = sub.add_parser("benchmark", help="compare cold-start time and memory")
+    bench.add_argument("model_id")
+    bench.add_argument("--dtype", default="float32")
+    bench.add_argument("--runs", type=int, default=3)
+
+    child = sub.add_parser("_child")
+    child.add_argument("kind", choices=["hub", "store"])
+    child.add_argument("model_id")
+    child.add_argument("dtype")
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        print(convert_to_store(args.model_id, getattr(torch, args.dtype)))
+    elif args.command == "benchmark":
+        results = benchmark_cold_start(args.model_id, getattr(torch, args.dtype), runs=args.runs)
+        print(json.dumps(results, indent=2))
+    else:
+        _bench_child(args.kind, args.model_id, args.dtype)
+
+
+__all__ = [
+    "MODEL_STORE_ROOT",
+    "store_path",
+    "is_stored",
+    "stored_bytes",
+    "save_to_store",
+    "convert_to_store",
+    "load_from_store",
+    "mmap_safetensors",
+    "benchmark_cold_start",
+]
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import os
+import threading
+import warnings
+from contextlib import nullcontext
 from dataclasses import dataclass
-from typing import Optional
+from typing import ContextManager, Dict, Optional
 
 import torch
 from diffusers import StableDiffusionPipeline
 
+from .model_store import is_stored, load_from_store, save_to_store
+
 
 @dataclass
 class SDConfig:
@@ -22,36 +28,84 @@ class SDConfig:
     seed: Optional[int] = None
 
 
+OFFLOAD_MODES = ("none", "model", "sequential")
+
+
+def default_device() -> torch.device:
+    return torch.device("mps") if torch.backends.mps.is_available() else torch.device("cpu")
+
+
+def default_dtype() -> torch.dtype:
+    return torch.float16 if default_device().type == "mps" else torch.float32
+
+
+def _weight_bytes(pipe: StableDiffusionPipeline) -> int:
+    total = 0
+    for component in pipe.components.values():
+        if isinstance(component, torch.nn.Module):
+            for t in list(component.parameters()) + list(component.buffers()):
+                total += t.numel() * t.element_size()
+    return total
+
+
 class SDMPSPipeline:
     """Thin wrapper around diffusers StableDiffusionPipeline with Apple Silicon (MPS) support.
 
     - Prefers MPS device on Apple Silicon, falls back to CPU.
     - Runs a one-time warmup inference on first use to stabilize performance.
     - Avoids unsupported float64 usage on MPS.
+    - Optionally keeps idle components on the CPU (``offload="model"`` moves each
+      component to the device only while it runs; ``"sequential"`` does the same
+      per submodule for the lowest footprint).
+    - Loads weights memory-mapped from the local model store, converting the model
+      into it on first use (disable with ``use_store=False`` or
+      ``DREAMCANVAS_MODEL_STORE=0``).
+    - Uses float16 on MPS and float32 on CPU unless ``dtype`` is given (e.g. to
+      reproduce a record made on another device).
+    - With ``device_budget_bytes``, falls back from ``offload="none"`` to model
+      offload when the weights would not fit, checked before anything is placed.
     """
 
-    def __init__(self, config: Optional[SDConfig] = None) -> None:
+    def __init__(
+        self,
+        config: Optional[SDConfig] = None,
+        *,
+        offload: str = "none",
+        use_store: Optional[bool] = None,
+        dtype: Optional[torch.dtype] = None,
+        device_budget_bytes: Optional[int] = None,
+    ) -> None:
+        if offload not in OFFLOAD_MODES:
+            raise ValueError(f"Unknown offload mode {offload!r}. Allowed: {', '.join(OFFLOAD_MODES)}")
+
         self.config = config or SDConfig()
+        self.offload = offload
+        if use_store is None:
+            use_store = os.environ.get("DREAMCANVAS_MODEL_STORE", "1") != "0"
+        self.use_store = use_store
+        self.device_budget_bytes = device_budget_bytes
 
-        if torch.backends.mps.is_available():
-            self.device = torch.device("mps")
-        else:
-            self.device = torch.device("cpu")
+        self.device = default_device()
+        self.dtype = dtype if dtype is not None else default_dtype()
 
         self._pipe: Optional[StableDiffusionPipeline] = None
         self._warmed_up: bool = False
+        self._offload_lock = threading.Lock()
 
     def _load_pipeline(self) -> StableDiffusionPipeline:
         if self._pipe is not None:
             return self._pipe
 
-        pipe = StableDiffusionPipeline.from_pretrained(
-            self.config.model_id,
-            torch_dtype=torch.float16 if self.device.type == "mps" else torch.float32,
-        )
+        model_id = self.config.model_id
+        if self.use_store and is_stored(model_id, self.dtype):
+            pipe = load_from_store(model_id, self.dtype)
+        else:
+            pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=self.dtype)
+            if self.use_store:
+                # One-time conversion so later cold starts map weights instead of parsing them.
+                save_to_store(pipe, model_id, self.dtype)
 
-        # Safety: ensure no float64 tensors on MPS which can cause errors.
-        pipe = pipe.to(self.device)
+        pipe = self._place(pipe)
 
         # Enable memory-efficient attention if available
         if hasattr(pipe, "enable_attention_slicing"):
@@ -60,6 +114,62 @@ class SDMPSPipeline:
         self._pipe = pipe
         return pipe
 
+    def _place(self, pipe: StableDiffusionPipeline) -> StableDiffusionPipeline:
+        budget = self.device_budget_bytes
+        if self.offload == "none" and budget is not None and _weight_bytes(pipe) > budget:
+            # Still on the CPU here, so the size is known before the device is touched.
+            self.offload = "model"
+
+        # Offloading only makes sense when there is a separate accelerator.
+        if self.offload != "none" and self.device.type != "cpu":
+            try:
+                if self.offload == "model":
+                    pipe.enable_model_cpu_offload(device=self.device)
+                else:
+                    pipe.enable_sequential_cpu_offload(device=self.device)
+                return pipe
+            except ImportError as e:  # accelerate is not installed
+                warnings.warn(f"CPU offload unavailable, keeping model on {self.device}: {e}")
+                self.offload = "none"
+
+        # Safety: ensure no float64 tensors on MPS which can cause errors.
+        return pipe.to(self.device)
+
+    def run_lock(self) -> ContextManager[object]:
+        """Hold around one denoising run on this pipeline's components.
+
+        Runs on resident weights can overlap (each has its own pipeline object and
+        scheduler). Offload hooks move shared components between devices, so
+        offloaded pipelines run one at a time.
+        """
+
+        return self._offload_lock if self.offload != "none" else nullcontext()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._pipe is not None
+
+    def resident_bytes(self) -> Dict[str, Dict[str, int]]:
+        """Bytes held by each pipeline component, keyed by component then device type.
+
+        Offloaded submodules whose weights are not materialized report under ``meta``.
+        """
+
+        report: Dict[str, Dict[str, int]] = {}
+        if self._pipe is None:
+            return report
+
+        for name, component in self._pipe.components.items():
+            if not isinstance(component, torch.nn.Module):
+                continue
+            per_device: Dict[str, int] = {}
+            tensors = list(component.parameters()) + list(component.buffers())
+            for t in tensors:
+                key = t.device.type
+                per_device[key] = per_device.get(key, 0) + t.numel() * t.element_size()
+            report[name] = per_device
+        return report
+
     def _warmup(self) -> None:
         if self._warmed_up:
             return
@@ -91,5 +201,5 @@ class SDMPSPipeline:
         return self._pipe
 
 
-__all__ = ["SDConfig", "SDMPSPipeline"]
+__all__ = ["SDConfig", "SDMPSPipeline", "OFFLOAD_MODES", "default_device", "default_dtype"]
 
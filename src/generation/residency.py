@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import gc
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+
+from ..presets.embeddings import get_preset_bank
+from .model_store import is_stored, save_to_store, stored_bytes
+from .pipeline import OFFLOAD_MODES, SDConfig, SDMPSPipeline, default_dtype
+
+
+def _env_budget_bytes() -> Optional[int]:
+    value = os.environ.get("DREAMCANVAS_MEMORY_BUDGET_MB")
+    if not value:
+        return None
+    return int(float(value) * 1024 * 1024)
+
+
+@dataclass
+class ResidencyConfig:
+    """How many pipelines may stay loaded and how they are placed.
+
+    - ``memory_budget_bytes``: upper bound for weights held on the compute device
+      by all resident pipelines (``None`` = unbounded). Defaults to
+      ``DREAMCANVAS_MEMORY_BUDGET_MB``.
+    - ``offload``: ``"none"``, ``"model"``, ``"sequential"`` or ``"auto"``. ``auto``
+      keeps everything on the device unless a single pipeline would exceed the
+      budget, then falls back to model offload. The size comes from an earlier
+      load or the model store; otherwise the weights are measured on the CPU
+      before any reach the device. Defaults to ``DREAMCANVAS_OFFLOAD``.
+    - ``preload_preset_bank``: load (or build) the preset embedding bank as soon as
+      a model is loaded. Defaults to ``DREAMCANVAS_PRESET_BANK=1``.
+    """
+
+    memory_budget_bytes: Optional[int] = field(default_factory=_env_budget_bytes)
+    offload: str = field(default_factory=lambda: os.environ.get("DREAMCANVAS_OFFLOAD", "auto"))
+    preload_preset_bank: bool = field(
+        default_factory=lambda: os.environ.get("DREAMCANVAS_PRESET_BANK", "0") == "1"
+    )
+
+
+def _device_bytes(wrapper: SDMPSPipeline) -> int:
+    # The budget covers weights on the compute device; offloaded components
+    # parked on the CPU (or not materialized at all) do not count against it.
+    device_type = wrapper.device.type
+    report = wrapper.resident_bytes()
+    return sum(per_device.get(device_type, 0) for per_device in report.values())
+
+
+def _residency_key(model_id: str, dtype: Optional[torch.dtype]) -> str:
+    # The default dtype keeps the plain model id, so the common case reads as before.
+    if dtype is None or dtype == default_dtype():
+        return model_id
+    return f"{model_id} ({str(dtype).replace('torch.', '')})"
+
+
+def _release_device_memory() -> None:
+    gc.collect()
+    if torch.backends.mps.is_available() and hasattr(torch, "mps"):
+        torch.mps.empty_cache()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class ResidencyManager:
+    """LRU cache of loaded pipelines kept under a memory budget.
+
+    Pipelines are keyed by model id (plus the dtype when it is not the device
+    default, e.g. when reproducing a record made elsewhere). When loading a model would exceed the budget,
+    the least recently used pipelines are spilled to the local model store (once)
+    and dropped; asking for them again maps the stored safetensors instead of
+    parsing the hub checkpoint.
+
+    Pipelines taken with :meth:`pinned` are never evicted while in use; if only
+    pinned pipelines are left, loading another one goes over the budget instead.
+    """
+
+    def __init__(self, config: Optional[ResidencyConfig] = None) -> None:
+        self.config = config or ResidencyConfig()
+        if self.config.offload != "auto" and self.config.offload not in OFFLOAD_MODES:
+            raise ValueError(f"Unknown offload mode {self.config.offload!r}")
+
+        self._pipelines: "OrderedDict[str, SDMPSPipeline]" = OrderedDict()
+        # Last observed resident size per model, used to make room before loading.
+        self._known_sizes: Dict[str, int] = {}
+        # key -> number of runs currently using that pipeline
+        self._pins: Dict[str, int] = {}
+        # key -> lock held while that pipeline loads; the manager lock is not.
+        self._loading: Dict[str, threading.Lock] = {}
+        # (key, pipeline) pairs as of the last change, for report()
+        self._snapshot: List[Tuple[str, SDMPSPipeline]] = []
+        self._lock = threading.RLock()
+
+    def _expected_size(self, key: str, config: SDConfig, dtype: Optional[torch.dtype]) -> Optional[int]:
+        # Measured on an earlier load, else the weight size recorded in the model store.
+        known = self._known_sizes.get(key)
+        if known is not None:
+            return known
+        return stored_bytes(config.model_id, dtype if dtype is not None else default_dtype())
+
+    def _offload_for(self, expected: Optional[int]) -> str:
+        if self.config.offload != "auto":
+            return self.config.offload
+        budget = self.config.memory_budget_bytes
+        if budget is not None and expected is not None and expected > budget:
+            return "model"
+        return "none"
+
+    def get(self, config: SDConfig, *, dtype: Optional[torch.dtype] = None) -> SDMPSPipeline:
+        """Return a loaded, warmed-up pipeline for ``config.model_id`` (in ``dtype``).
+
+        Loading, warmup and spilling evicted pipelines happen outside the manager
+        lock, so other models (and :meth:`report`) are not blocked meanwhile;
+        callers asking for the same key wait for one load.
+        """
+
+        key = _residency_key(config.model_id, dtype)
+        with self._lock:
+            wrapper = self._touch(key)
+            if wrapper is not None:
+                return wrapper
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self._lock:
+                # Another caller may have loaded it while we waited.
+                wrapper = self._touch(key)
+            if wrapper is None:
+                wrapper = self._load(key, config, dtype)
+
+                with self._lock:
+                    self._pipelines[key] = wrapper
+                    victims = self._take_victims(0, keep=key)
+                    self._publish()
+                self._spill(victims)
+
+        if self.config.preload_preset_bank:
+            get_preset_bank(wrapper.pipe, config.model_id)
+        return wrapper
+
+    def _touch(self, key: str) -> Optional[SDMPSPipeline]:
+        wrapper = self._pipelines.get(key)
+        if wrapper is not None:
+            self._pipelines.move_to_end(key)
+        return wrapper
+
+    def _load(self, key: str, config: SDConfig, dtype: Optional[torch.dtype]) -> SDMPSPipeline:
+        expected = self._expected_size(key, config, dtype)
+        with self._lock:
+            offload = self._offload_for(expected)
+            victims = []
+            if offload == "none":
+                victims = self._take_victims(expected if expected is not None else self._largest_known_size())
+                self._publish()
+        self._spill(victims)
+
+        # With "auto", a model of unknown size is measured on the CPU before it is
+        # placed, and offloaded if it alone would exceed the budget.
+        auto_budget = self.config.memory_budget_bytes if self.config.offload == "auto" else None
+        wrapper = SDMPSPipeline(config=config, offload=offload, dtype=dtype, device_budget_bytes=auto_budget)
+        # Touch .pipe so load + warmup happen before anyone else sees it.
+        _ = wrapper.pipe
+        if wrapper.offload == "none":
+            size = _device_bytes(wrapper)
+            with self._lock:
+                self._known_sizes[key] = size
+        return wrapper
+
+    @contextmanager
+    def pinned(self, config: SDConfig, *, dtype: Optional[torch.dtype] = None) -> Iterator[SDMPSPipeline]:
+        """:meth:`get`, with the pipeline kept resident until the block exits."""
+
+        key = _residency_key(config.model_id, dtype)
+        while True:
+            wrapper = self.get(config, dtype=dtype)
+            with self._lock:
+                # Evicted between get() and here: load it again.
+                if self._pipelines.get(key) is wrapper:
+                    self._pins[key] = self._pins.get(key, 0) + 1
+                    break
+        try:
+            yield wrapper
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+
+    def _largest_known_size(self) -> int:
+        return max(self._known_sizes.values(), default=0)
+
+    def _resident_total(self) -> int:
+        return sum(_device_bytes(w) for w in self._pipelines.values())
+
+    def _take_victims(self, incoming_bytes: int, keep: Optional[str] = None) -> List[SDMPSPipeline]:
+        """Remove least recently used pipelines until ``incoming_bytes`` fits; call with the lock held.
+
+        The returned pipelines still hold their memory until :meth:`_spill`.
+        """
+
+        budget = self.config.memory_budget_bytes
+        if budget is None:
+            return []
+
+        victims = []
+        total = self._resident_total()
+        # OrderedDict order is least recently used first.
+        for key in [k for k in self._pipelines if k != keep and k not in self._pins]:
+            if total + incoming_bytes <= budget:
+                break
+            wrapper = self._pipelines.pop(key)
+            total -= _device_bytes(wrapper)
+            victims.append(wrapper)
+        return victims
+
+    def _publish(self) -> None:
+        # Call with the lock held after every change to _pipelines.
+        self._snapshot = list(self._pipelines.items())
+
+    def _spill(self, wrappers: List[SDMPSPipeline]) -> None:
+        # Runs without the manager lock: saving to the model store is slow.
+        # Empties ``wrappers`` so the last references go before memory is released.
+        if not wrappers:
+            return
+        while wrappers:
+            wrapper = wrappers.pop()
+            model_id = wrapper.config.model_id
+            # Sequentially offloaded weights are not materialized and cannot be spilled;
+            # such a model reloads from the hub cache instead.
+            if (
+                wrapper.is_loaded
+                and wrapper.offload != "sequential"
+                and not is_stored(model_id, wrapper.dtype)
+            ):
+                save_to_store(wrapper.pipe, model_id, wrapper.dtype)
+            del wrapper
+        _release_device_memory()
+
+    def evict(self, key: str) -> None:
+        """Drop a pipeline now, unless a run is using it."""
+
+        with self._lock:
+            if key in self._pins or key not in self._pipelines:
+                return
+            evicted = [self._pipelines.pop(key)]
+            self._publish()
+        self._spill(evicted)
+
+    def report(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """Resident bytes per model (and non-default dtype), per component, per device type.
+
+        Reads the last published set of pipelines without taking the manager lock.
+        """
+
+        return {key: w.resident_bytes() for key, w in self._snapshot}
+
+
+_MANAGER: Optional[ResidencyManager] = None
+
+
+def get_residency_manager() -> ResidencyManager:
+    global _MANAGER
+    if _MANAGER is None:
+        _MANAGER = ResidencyManager()
+    return _MANAGER
+
+
+__all__ = ["ResidencyConfig", "ResidencyManager", "get_residency_manager"]
@@ -0,0 +1,374 @@
+"""Re-run stored records and check that they reproduce.
+
+Each record is generated again with its own seed, dtype, scheduler, prompt
+encoding path and (for variations) its source latents, then compared with the
+stored PNG by pixel hash and by perceptual distance (pHash, SSIM, PSNR).
+Results are grouped by the environment the original was made in (device,
+dtype, library versions) into a drift report.
+
+Run over the gallery after an upgrade::
+
+    python -m src.generation.verify --workers 2 --report drift.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ..metrics import quality
+from ..presets.embeddings import PresetComposition
+from ..storage import store
+from ..storage.index import record_key
+from ..storage.latents import load_latents
+from ..storage.store import GenerationRecord
+from .generate import iter_generate, library_versions
+from .pipeline import default_device, default_dtype
+
+
+VERIFY_STATUSES = ("exact", "close", "drift", "error")
+
+# "close": not bit-identical, but visually the same image.
+MAX_PHASH_DISTANCE = 4
+MIN_SSIM = 0.98
+
+_ENV_KEYS = ("device", "dtype", "torch", "diffusers", "transformers")
+
+
+def record_dtype(meta: Dict[str, Any]) -> str:
+    """dtype a record was generated in; older records imply it from the device."""
+
+    if meta.get("dtype"):
+        return str(meta["dtype"])
+    return "float16" if str(meta.get("device", "")).startswith("mps") else "float32"
+
+
+def record_environment(meta: Dict[str, Any]) -> Dict[str, str]:
+    versions = meta.get("versions") or {}
+    return {
+        "device": str(meta.get("device") or "unknown"),
+        "dtype": record_dtype(meta),
+        "torch": versions.get("torch", "unknown"),
+        "diffusers": versions.get("diffusers", "unknown"),
+        "transformers": versions.get("transformers", "unknown"),
+    }
+
+
+def reproduction_kwargs(meta: Dict[str, Any]) -> Dict[str, Any]:
+    """:func:`iter_generate` arguments that re-create the record described by ``meta``.
+
+    Uses the record's own ``seed`` (not the batch ``base_seed``), so every image
+    of a batch reproduces on its own.
+    """
+
+    kwargs: Dict[str, Any] = {
+        "prompt": meta.get("prompt", ""),
+        "negative_prompt": meta.get("negative_prompt") or "",
+        "base_seed": int(meta.get("seed", 0)),
+        "num_images": 1,
+        "num_inference_steps": int(meta.get("steps", 30)),
+        "guidance_scale": float(meta.get("guidance_scale", 7.5)),
+        "height": int(meta.get("height", 512)),
+        "width": int(meta.get("width", 512)),
+        "model_id": meta.get("model_id", "runwayml/stable-diffusion-v1-5"),
+        "dtype": record_dtype(meta),
+        "scheduler_config": meta.get("scheduler_config"),
+    }
+    if meta.get("prompt_encoding") == "preset_bank" and meta.get("preset_composition"):
+        kwargs["preset_composition"] = PresetComposition(**meta["preset_composition"])
+    if meta.get("mode") == "vary":
+        if not meta.get("init_latent_path"):
+            raise ValueError("variation record does not say which latents it started from")
+        kwargs["init_latents"] = load_latents(Path(meta["init_latent_path"]))
+        kwargs["strength"] = float(meta.get("strength", 0.6))
+    return kwargs
+
+
+# Set by the caller that loaded the init latents; iter_generate only sees the array.
+_SOURCE_KEYS = ("source_record_id", "init_latent_path")
+
+
+def reproduce(meta: Dict[str, Any]) -> Tuple[Image.Image, Dict[str, Any]]:
+    """Generate the record described by ``meta`` again; returns (image, new metadata).
+
+    A reproduced variation keeps the source fields, so it can be reproduced too.
+    """
+
+    # Closed explicitly so the pipeline's residency pin is released right away.
+    with closing(iter_generate(**reproduction_kwargs(meta))) as run:
+        image, new_meta = next(run)
+    if new_meta.get("mode") == "vary":
+        new_meta.update({k: meta[k] for k in _SOURCE_KEYS if meta.get(k)})
+    return image, new_meta
+
+
+def pixel_sha256(image: Image.Image) -> str:
+    """Hash of the decoded RGB pixels, independent of PNG encoder settings."""
+
+    rgb = image.convert("RGB")
+    digest = hashlib.sha256(f"{rgb.width}x{rgb.height}:".encode())
+    digest.update(rgb.tobytes())
+    return digest.hexdigest()
+
+
+@dataclass
+class VerifyResult:
+    key: str
+    id: str
+    status: str
+    environment: Dict[str, str] = field(default_factory=dict)
+    pixel_match: bool = False
+    phash_distance: Optional[int] = None
+    ssim: Optional[float] = None
+    psnr: Optional[float] = None
+    duration_sec: float = 0.0
+    reproduction_path: Optional[str] = None
+    error: Optional[str] = None
+
+
+def compare_images(
+    original: Image.Image,
+    reproduced: Image.Image,
+    *,
+    max_phash_distance: int = MAX_PHASH_DISTANCE,
+    min_ssim: float = MIN_SSIM,
+) -> Dict[str, Any]:
+    """Pixel hash and perceptual comparison; ``status`` is exact, close or drift."""
+
+    if pixel_sha256(original) == pixel_sha256(reproduced):
+        # PSNR is undefined (infinite) for identical images and left empty.
+        return {"status": "exact", "pixel_match": True, "phash_distance": 0, "ssim": 1.0, "psnr": None}
+    if original.size != reproduced.size:
+        return {"status": "drift", "pixel_match": False}
+
+    batch = np.stack([np.asarray(original.convert("RGB")), np.asarray(reproduced.convert("RGB"))])
+    hashes = quality.phash(batch)
+    distance = int(quality.hamming(hashes[:1], hashes[1:])[0, 0])
+    ssim = float(quality.ssim(batch[:1], batch[1:])[0])
+    psnr = float(quality.psnr(batch[:1], batch[1:])[0])
+    close = distance <= max_phash_distance and ssim >= min_ssim
+    return {
+        "status": "close" if close else "drift",
+        "pixel_match": False,
+        "phash_distance": distance,
+        "ssim": ssim,
+        "psnr": psnr,
+    }
+
+
+@dataclass
+class DriftReport:
+    """Verification results plus the environment they were reproduced in."""
+
+    environment: Dict[str, Any]
+    results: List[VerifyResult]
+
+    def counts(self) -> Dict[str, int]:
+        out = {status: 0 for status in VERIFY_STATUSES}
+        for r in self.results:
+            out[r.status] += 1
+        return out
+
+    @property
+    def ok(self) -> bool:
+        counts = self.counts()
+        return counts["drift"] == 0 and counts["error"] == 0
+
+    def groups(self) -> List[Dict[str, Any]]:
+        """Results grouped by the original's environment, with what differs from now."""
+
+        current = {k: str(self.environment.get(k, "")) for k in _ENV_KEYS}
+        grouped: Dict[Tuple[str, ...], List[VerifyResult]] = {}
+        for r in self.results:
+            if r.environment:
+                grouped.setdefault(tuple(r.environment[k] for k in _ENV_KEYS), []).append(r)
+
+        out = []
+        for env_values, results in sorted(grouped.items()):
+            env = dict(zip(_ENV_KEYS, env_values))
+            counts = {status: 0 for status in VERIFY_STATUSES}
+            for r in results:
+                counts[r.status] += 1
+            ssims = [r.ssim for r in results if r.ssim is not None]
+            out.append(
+                {
+                    "environment": env,
+                    "changed": [k for k in _ENV_KEYS if env[k] != current[k]],
+                    "records": len(results),
+                    **counts,
+                    "min_ssim": min(ssims) if ssims else None,
+                }
+            )
+        return out
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "environment": self.environment,
+            "counts": self.counts(),
+            "groups": self.groups(),
+            "results": [asdict(r) for r in self.results],
+        }
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def format(self) -> str:
+        lines = [
+            f"Reproduced on {self.environment['device']} with "
+            + ", ".join(f"{k} {v}" for k, v in self.environment["versions"].items()),
+            " ".join(f"{status}={n}" for status, n in self.counts().items()),
+            "",
+        ]
+        for g in self.groups():
+            env = g["environment"]
+            changed = ", ".join(g["changed"]) or "nothing"
+            ssim = "-" if g["min_ssim"] is None else f"{g['min_ssim']:.4f}"
+            lines.append(
+                f"{env['device']} {env['dtype']} torch {env['torch']} diffusers {env['diffusers']} "
+                f"(changed: {changed}): {g['records']} record(s), exact {g['exact']}, close {g['close']}, "
+                f"drift {g['drift']}, error {g['error']}, min SSIM {ssim}"
+            )
+        for r in self.results:
+            if r.status == "error":
+                lines.append(f"error {r.key}: {r.error}")
+        return "\n".join(lines)
+
+
+def verify_record(
+    record: GenerationRecord,
+    *,
+    output_dir: Optional[Path] = None,
+    max_phash_distance: int = MAX_PHASH_DISTANCE,
+    min_ssim: float = MIN_SSIM,
+) -> VerifyResult:
+    """Reproduce one record and compare it with the stored image."""
+
+    key = record_key(record)
+    result = VerifyResult(key=key, id=record.id, status="error")
+    t0 = perf_counter()
+    try:
+        meta = store.load_metadata(record)
+        result.environment = record_environment(meta)
+        image, _ = reproduce(meta)
+
+        with Image.open(record.image_path) as original:
+            comparison = compare_images(
+                original, image, max_phash_distance=max_phash_distance, min_ssim=min_ssim
+            )
+        for name, value in comparison.items():
+            setattr(result, name, value)
+
+        if output_dir is not None and result.status == "drift":
+            output_dir.mkdir(parents=True, exist_ok=True)
+            path = output_dir / f"{key.replace('/', '_')}.png"
+            image.save(path, format="PNG")
+            result.reproduction_path = str(path)
+    except Exception as e:  # noqa: BLE001 - one bad record must not stop the run
+        result.status = "error"
+        result.error = f"{type(e).__name__}: {e}"
+    result.duration_sec = perf_counter() - t0
+    return result
+
+
+def verify_records(
+    records: Iterable[GenerationRecord],
+    *,
+    workers: int = 2,
+    output_dir: Optional[Path] = None,
+    max_phash_distance: int = MAX_PHASH_DISTANCE,
+    min_ssim: float = MIN_SSIM,
+    on_result: Optional[Callable[[VerifyResult], None]] = None,
+) -> DriftReport:
+    """Verify many records in parallel and return a :class:`DriftReport`.
+
+    Records run on a thread pool through the shared, cached pipelines. Each run
+    has its own pipeline object and scheduler, so runs overlap also on a single
+    model (except when it is offloaded, see ``SDMPSPipeline.run_lock``), and so
+    do loading, hashing and comparing images. Drifted reproductions are written
+    to ``output_dir`` if given.
+    """
+
+    records = list(records)
+    # Keep records of one pipeline together so workers mostly hit loaded models.
+    records.sort(key=lambda r: (r.model_id, r.created_at))
+
+    def run(record: GenerationRecord) -> VerifyResult:
+        result = verify_record(
+            record,
+            output_dir=output_dir,
+            max_phash_distance=max_phash_distance,
+            min_ssim=min_ssim,
+        )
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(run, records))
+
+    versions = library_versions()
+    environment: Dict[str, Any] = {
+        "device": str(default_device()),
+        # Each record is reproduced in its own dtype; this is the device default.
+        "dtype": str(default_dtype()).replace("torch.", ""),
+        **{k: versions[k] for k in _ENV_KEYS if k in versions},
+        "versions": versions,
+    }
+    return DriftReport(environment=environment, results=results)
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Re-run stored records and report reproduction drift")
+    parser.add_argument("--date", help="only records from this YYYY-MM-DD directory")
+    parser.add_argument("--preset", help="only records with this preset id")
+    parser.add_argument("--keyword", help="only records whose prompt contains this")
+    parser.add_argument("--limit", type=int, help="verify at most this many (newest first)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--report", type=Path, help="write the full report as JSON")
+    parser.add_argument("--save-drift", type=Path, help="write drifted reproductions here")
+    args = parser.parse_args(argv)
+
+    records = store.list_generations(preset_id=args.preset, date=args.date, keyword=args.keyword)
+    if args.limit is not None:
+        records = records[: args.limit]
+
+    def progress(result: VerifyResult) -> None:
+        print(f"{result.status:5s} {result.key} ({result.duration_sec:.1f}s)", file=sys.stderr)
+
+    report = verify_records(records, workers=args.workers, output_dir=args.save_drift, on_result=progress)
+    print(report.format())
+    if args.report is not None:
+        report.save(args.report)
+    sys.exit(0 if report.ok else 1)
+
+
+__all__ = [
+    "VERIFY_STATUSES",
+    "VerifyResult",
+    "DriftReport",
+    "record_environment",
+    "reproduction_kwargs",
+    "reproduce",
+    "pixel_sha256",
+    "compare_images",
+    "verify_record",
+    "verify_records",
+]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import gzip
+import os
+import sys
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+
+PROFILE_ENV = "DREAMCANVAS_PROFILE"
+
+# Pipeline methods timed and labelled as stages in the trace.
+_STAGES: List[Tuple[str, str, str]] = [
+    ("text_encoder", "text_encoder", "forward"),
+    ("unet", "unet", "forward"),
+    ("vae_decode", "vae", "decode"),
+]
+
+
+# Profiling patches methods on pipeline components, which are shared between
+# pipeline objects; one profiled run at a time keeps the patches from interleaving.
+_PATCH_LOCK = threading.Lock()
+
+
+def _synchronize(device: torch.device) -> None:
+    # GPU kernels run asynchronously; wait for them so stage times cover the work.
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+def profiling_enabled(requested: Optional[bool] = None) -> bool:
+    """Per-request flag if given, otherwise ``DREAMCANVAS_PROFILE=1``."""
+
+    if requested is not None:
+        return requested
+    return os.environ.get(PROFILE_ENV, "0") == "1"
+
+
+class StackSampler:
+    """Samples the Python stack of one thread at a fixed interval.
+
+    Output is the collapsed ``frame;frame;frame count`` format understood by
+    flamegraph.pl, speedscope and inferno.
+    """
+
+    def __init__(self, thread_id: int, interval_sec: float = 0.005) -> None:
+        self.thread_id = thread_id
+        self.interval_sec = interval_sec
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_sec):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write_folded(self, path: Path) -> None:
+        with path.open("w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class GenerationProfiler:
+    """Profile one pipeline call with ``torch.profiler`` plus a Python stack sampler.
+
+    Used as a context manager around the call. Stages (text encoder, UNet, VAE
+    decode) are labelled in the trace and timed; afterwards :meth:`artifacts`
+    returns a gzipped Chrome trace and a folded-stack flamegraph as bytes, plus
+    stage timings, for :func:`save_generation` to write next to the record.
+    Nothing is left on disk, so callers that drop the metadata leak nothing.
+
+    Only construct it when profiling is enabled; the disabled path is a plain call.
+
+    Stage timings synchronize the device around each stage, which slows the run
+    a little. The stage methods are patched on the components themselves, so
+    profiled runs are serialized. An unprofiled run sharing those components
+    at the same time is timed into this profile too.
+    """
+
+    def __init__(self, pipe: Any) -> None:
+        self.pipe = pipe
+        self.trace_gz = b""
+        self.stacks = b""
+        self.stage_sec: Dict[str, float] = {}
+        self.device = torch.device(getattr(pipe, "device", "cpu"))
+        self._restore: List[Tuple[Any, str, Any]] = []
+        self._profiler: Optional[torch.profiler.profile] = None
+        self._sampler: Optional[StackSampler] = None
+
+    def _wrap(self, obj: Any, attr: str, label: str) -> None:
+        # Instance attributes may already be wrapped (e.g. by offload hooks);
+        # remember exactly what was there so it can be put back.
+        previous = obj.__dict__.get(attr)
+        inner: Callable[..., Any] = getattr(obj, attr)
+
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            _synchronize(self.device)
+            t0 = perf_counter()
+            with torch.profiler.record_function(f"dreamcanvas::{label}"):
+                out = inner(*args, **kwargs)
+                _synchronize(self.device)
+            self.stage_sec[label] = self.stage_sec.get(label, 0.0) + perf_counter() - t0
+            return out
+
+        setattr(obj, attr, timed)
+        self._restore.append((obj, attr, previous))
+
+    def _unpatch(self) -> None:
+        for obj, attr, previous in reversed(self._restore):
+            if previous is None:
+                delattr(obj, attr)
+            else:
+                setattr(obj, attr, previous)
+        self._restore.clear()
+        _PATCH_LOCK.release()
+
+    def __enter__(self) -> "GenerationProfiler":
+        _PATCH_LOCK.acquire()
+        try:
+            for label, component, attr in _STAGES:
+                obj = getattr(self.pipe, component, None)
+                if obj is not None:
+                    self._wrap(obj, attr, label)
+
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(activities=activities)
+            self._profiler.__enter__()
+        except BaseException:
+            self._unpatch()
+            raise
+
+        self._sampler = StackSampler(threading.get_ident())
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        assert self._sampler is not None and self._profiler is not None
+        try:
+            self._sampler.stop()
+            self._profiler.__exit__(*exc)
+        finally:
+            self._unpatch()
+
+        if exc[0] is not None:
+            return
+
+        # torch only exports to a file; read it back and drop the directory at once.
+        with tempfile.TemporaryDirectory(prefix="dreamcanvas-profile-") as tmp:
+            trace_path = Path(tmp) / "trace.json"
+            self._profiler.export_chrome_trace(str(trace_path))
+            self.trace_gz = gzip.compress(trace_path.read_bytes())
+            stacks_path = Path(tmp) / "stacks.folded"
+            self._sampler.write_folded(stacks_path)
+            self.stacks = stacks_path.read_bytes()
+
+    def artifacts(self) -> Dict[str, Any]:
+        """``trace`` (gzipped JSON) and ``stacks`` as bytes, ``stages`` in seconds."""
+
+        return {
+            "trace": self.trace_gz,
+            "stacks": self.stacks,
+            "stages": dict(self.stage_sec),
+        }
+
+
+__all__ = ["PROFILE_ENV", "profiling_enabled", "StackSampler", "GenerationProfiler"]
@@ -0,0 +1,153 @@
+"""Vectorized image statistics and similarity measures.
+
+Every function takes a batch as a NumPy array shaped [N, H, W, 3] (uint8 RGB) or
+[N, H, W] (grayscale) and returns one value per image (or per pair), so whole
+galleries are processed without per-image Python loops.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Dict
+
+import numpy as np
+
+
+HASH_SIZE = 8
+_DCT_SIZE = 32
+
+# ITU-R BT.601 luma weights
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def to_gray(batch: np.ndarray) -> np.ndarray:
+    """[N, H, W, 3] uint8 -> [N, H, W] float32 in [0, 255]."""
+
+    if batch.ndim == 3:
+        return batch.astype(np.float32)
+    return batch.astype(np.float32) @ _LUMA
+
+
+def _downsample(gray: np.ndarray, size: int) -> np.ndarray:
+    # Area-average to size x size; thumbnails are a multiple of the hash size.
+    n, h, w = gray.shape
+    if h % size or w % size:
+        raise ValueError(f"image size {h}x{w} is not a multiple of {size}")
+    return gray.reshape(n, size, h // size, size, w // size).mean(axis=(2, 4))
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m.astype(np.float32)
+
+
+def phash(batch: np.ndarray) -> np.ndarray:
+    """64-bit perceptual hashes (DCT of a 32x32 luma image), as uint64 [N]."""
+
+    small = _downsample(to_gray(batch), _DCT_SIZE)
+    d = _dct_matrix(_DCT_SIZE)
+    coeffs = np.einsum("ij,njk,lk->nil", d, small, d)[:, :HASH_SIZE, :HASH_SIZE]
+    flat = coeffs.reshape(len(coeffs), -1)
+    # Median over the AC coefficients; the DC term only tracks overall brightness.
+    median = np.median(flat[:, 1:], axis=1, keepdims=True)
+    bits = (flat > median).astype(np.uint8)
+    packed = np.packbits(bits, axis=1)  # [N, 8] bytes, big-endian bit order
+    return packed.view(">u8").astype(np.uint64).ravel()
+
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise Hamming distances between uint64 hashes: [N] x [M] -> [N, M] uint8."""
+
+    x = np.bitwise_xor(a[:, None], b[None, :])
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(x).astype(np.uint8)
+    return _POPCOUNT8[x.view(np.uint8).reshape(*x.shape, 8)].sum(axis=-1, dtype=np.uint8)
+
+
+def sharpness(batch: np.ndarray) -> np.ndarray:
+    """Variance of the Laplacian per image; higher is sharper."""
+
+    g = to_gray(batch)
+    lap = (
+        g[:, :-2, 1:-1] + g[:, 2:, 1:-1] + g[:, 1:-1, :-2] + g[:, 1:-1, 2:] - 4.0 * g[:, 1:-1, 1:-1]
+    )
+    return lap.reshape(len(lap), -1).var(axis=1)
+
+
+def colorfulness(batch: np.ndarray) -> np.ndarray:
+    """Hasler & Suesstrunk colorfulness per image; 0 for grayscale."""
+
+    rgb = batch.astype(np.float32)
+    rg = rgb[..., 0] - rgb[..., 1]
+    yb = 0.5 * (rgb[..., 0] + rgb[..., 1]) - rgb[..., 2]
+    rg = rg.reshape(len(rg), -1)
+    yb = yb.reshape(len(yb), -1)
+    std = np.sqrt(rg.var(axis=1) + yb.var(axis=1))
+    mean = np.sqrt(rg.mean(axis=1) ** 2 + yb.mean(axis=1) ** 2)
+    return std + 0.3 * mean
+
+
+def image_stats(batch: np.ndarray) -> Dict[str, np.ndarray]:
+    """All per-image statistics stored in the gallery index."""
+
+    gray = to_gray(batch).reshape(len(batch), -1)
+    return {
+        "phash": phash(batch),
+        "sharpness": sharpness(batch),
+        "colorfulness": colorfulness(batch),
+        "brightness": gray.mean(axis=1),
+        "contrast": gray.std(axis=1),
+    }
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Peak signal-to-noise ratio in dB for each pair a[i], b[i]; inf when identical."""
+
+    diff = a.astype(np.float32) - b.astype(np.float32)
+    mse = (diff ** 2).reshape(len(diff), -1).mean(axis=1)
+    with np.errstate(divide="ignore"):
+        return 10.0 * np.log10(255.0 ** 2 / mse)
+
+
+def _box_mean(x: np.ndarray, win: int) -> np.ndarray:
+    # Mean over every win x win window via a summed-area table ("valid" output).
+    s = np.pad(x, ((0, 0), (1, 0), (1, 0))).cumsum(axis=1).cumsum(axis=2)
+    total = s[:, win:, win:] - s[:, :-win, win:] - s[:, win:, :-win] + s[:, :-win, :-win]
+    return total / float(win * win)
+
+
+def ssim(a: np.ndarray, b: np.ndarray, win: int = 7) -> np.ndarray:
+    """Mean structural similarity on luma for each pair a[i], b[i] (uniform window)."""
+
+    x = to_gray(a).astype(np.float64)
+    y = to_gray(b).astype(np.float64)
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+
+    mx, my = _box_mean(x, win), _box_mean(y, win)
+    vx = _box_mean(x * x, win) - mx * mx
+    vy = _box_mean(y * y, win) - my * my
+    cxy = _box_mean(x * y, win) - mx * my
+
+    s = ((2 * mx * my + c1) * (2 * cxy + c2)) / ((mx * mx + my * my + c1) * (vx + vy + c2))
+    return s.reshape(len(s), -1).mean(axis=1)
+
+
+__all__ = [
+    "HASH_SIZE",
+    "to_gray",
+    "phash",
+    "hamming",
+    "sharpness",
+    "colorfulness",
+    "image_stats",
+    "psnr",
+    "ssim",
+]
@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+from safetensors.torch import load_file, save_file
+
+from . import StylePreset, build_negative_prompt, compose_prompt, get_preset, list_presets
+
+
+BANK_ROOT = Path("models") / "preset_embeddings"
+
+# Fast composition is only used for presets whose probe prompts reach this mean
+# per-token cosine similarity against regular string composition.
+MIN_SIMILARITY = 0.95
+
+_PROBE_PROMPTS = [
+    "a portrait of a woman",
+    "an elegant product photo of a wireless headphone on a marble table",
+    "a small house in the mountains at sunset, snow, pine trees",
+]
+_PROBE_NEGATIVES = ["", "text, watermark, logo, low resolution, blurry"]
+
+
+@dataclass
+class PresetComposition:
+    """The uncomposed parts of a prompt, for the fast embedding path."""
+
+    preset_id: str
+    base_prompt: str
+    base_negative: str = ""
+
+    def describes(self, prompt: str, negative_prompt: Optional[str]) -> bool:
+        """True if composing these parts with the current preset gives exactly these prompts."""
+
+        preset = get_preset(self.preset_id)
+        if preset is None:
+            return False
+        return (
+            compose_prompt(self.base_prompt, preset) == prompt
+            and build_negative_prompt(self.base_negative, preset) == (negative_prompt or "")
+        )
+
+
+@dataclass
+class _Segment:
+    # Hidden states of BOS + text tokens + "," (no EOS). CLIP's text encoder is
+    # causal, so these equal the first positions of any prompt starting with text.
+    prefix: torch.Tensor
+    # Full padded encoding of the text on its own.
+    full: torch.Tensor
+
+
+def _slug(model_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "--", model_id)
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def _max_length(pipe) -> int:
+    return pipe.tokenizer.model_max_length
+
+
+def _encode_ids(pipe, ids: List[int]) -> torch.Tensor:
+    input_ids = torch.tensor([ids], device=pipe.text_encoder.device)
+    with torch.no_grad():
+        return pipe.text_encoder(input_ids)[0][0]
+
+
+def encode_text(pipe, text: str) -> torch.Tensor:
+    """Encode ``text`` the way diffusers does for a string prompt: [max_length, hidden]."""
+
+    ids = pipe.tokenizer(
+        text,
+        padding="max_length",
+        max_length=_max_length(pipe),
+        truncation=True,
+    ).input_ids
+    return _encode_ids(pipe, ids)
+
+
+def _encode_segment(pipe, text: str) -> _Segment:
+    tok = pipe.tokenizer
+    # compose_prompt joins with ", "; tokenizing the pieces separately matches
+    # because CLIP's BPE never merges across the comma.
+    ids = [tok.bos_token_id] + tok(f"{text},", add_special_tokens=False).input_ids
+    ids = ids[: _max_length(pipe) - 1]
+    full = encode_text(pipe, text)
+    prefix = _encode_ids(pipe, ids + [tok.eos_token_id])[: len(ids)]
+    return _Segment(prefix=prefix, full=full)
+
+
+def _splice(pipe, segment: _Segment, text: str) -> torch.Tensor:
+    """Prefix states from the bank + ``text`` encoded on its own, in one 77-token window.
+
+    Only the (short) text is run through the encoder, unpadded. Its tokens do not
+    attend to the prefix, which is why the result is validated per preset.
+    """
+
+    tok = pipe.tokenizer
+    max_length = _max_length(pipe)
+    n_prefix = segment.prefix.shape[0]
+
+    budget = max(max_length - n_prefix - 1, 0)
+    text_ids = tok(text, add_special_tokens=False).input_ids[:budget]
+    encoded = _encode_ids(pipe, [tok.bos_token_id] + text_ids + [tok.eos_token_id])
+
+    # Drop the text's own BOS; keep its tokens and EOS.
+    suffix = encoded[1:]
+    spliced = torch.cat([segment.prefix.to(suffix.dtype), suffix], dim=0)
+    pad = max_length - spliced.shape[0]
+    if pad > 0:
+        # Padding positions are filled with the EOS state, which they closely track.
+        spliced = torch.cat([spliced, suffix[-1:].expand(pad, -1)], dim=0)
+    return spliced[:max_length]
+
+
+def _cosine(a: torch.Tensor, b: torch.Tensor) -> float:
+    return float(torch.nn.functional.cosine_similarity(a.float(), b.float(), dim=-1).mean())
+
+
+class PresetEmbeddingBank:
+    """Per-model cache of encoded style prefixes and negative templates."""
+
+    def __init__(self, model_id: str) -> None:
+        self.model_id = model_id
+        self._prompt: Dict[str, _Segment] = {}
+        self._negative: Dict[str, _Segment] = {}
+        # preset id -> {"prompt_hash", "negative_hash", "similarity"}
+        self.info: Dict[str, Dict[str, object]] = {}
+
+    # -- building -----------------------------------------------------------
+
+    def _is_current(self, preset: StylePreset) -> bool:
+        info = self.info.get(preset.id)
+        return bool(
+            info
+            and info["prompt_hash"] == _text_hash(preset.style_prefix)
+            and info["negative_hash"] == _text_hash(preset.negative_prompt)
+        )
+
+    def build(self, pipe, presets: Optional[Sequence[StylePreset]] = None) -> bool:
+        """Encode and validate presets that are missing or changed. Returns True if any were."""
+
+        changed = False
+        for preset in presets if presets is not None else list_presets():
+            if self._is_current(preset):
+                continue
+            self._prompt.pop(preset.id, None)
+            self._negative.pop(preset.id, None)
+            if preset.style_prefix:
+                self._prompt[preset.id] = _encode_segment(pipe, preset.style_prefix)
+            if preset.negative_prompt:
+                self._negative[preset.id] = _encode_segment(pipe, preset.negative_prompt)
+            self.info[preset.id] = {
+                "prompt_hash": _text_hash(preset.style_prefix),
+                "negative_hash": _text_hash(preset.negative_prompt),
+                "similarity": validate_preset(pipe, self, preset),
+            }
+            changed = True
+        return changed
+
+    # -- composing ----------------------------------------------------------
+
+    def is_usable(self, preset_id: str) -> bool:
+        info = self.info.get(preset_id)
+        return bool(info and float(info["similarity"]) >= MIN_SIMILARITY)
+
+    def compose(
+        self,
+        pipe,
+        composition: PresetComposition,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Return ``(prompt_embeds, negative_prompt_embeds)`` shaped [1, max_length, hidden].
+
+        Parts that are preset-only come straight from the bank (exact); prompts
+        without a preset part are encoded normally.
+        """
+
+        preset = get_preset(composition.preset_id)
+        base_prompt = composition.base_prompt.strip()
+        base_negative = composition.base_negative.strip()
+
+        prompt_seg = self._prompt.get(composition.preset_id)
+        if prompt_seg is None:
+            prompt_embeds = encode_text(pipe, compose_prompt(base_prompt, preset))
+        elif not base_prompt:
+            prompt_embeds = prompt_seg.full
+        else:
+            prompt_embeds = _splice(pipe, prompt_seg, base_prompt)
+
+        negative_seg = self._negative.get(composition.preset_id)
+        if negative_seg is None:
+            negative_embeds = encode_text(pipe, build_negative_prompt(base_negative, preset))
+        elif not base_negative:
+            negative_embeds = negative_seg.full
+        else:
+            negative_embeds = _splice(pipe, negative_seg, base_negative)
+
+        dtype = pipe.text_encoder.dtype
+        return prompt_embeds[None].to(dtype), negative_embeds[None].to(dtype)
+
+    # -- persistence --------------------------------------------------------
+
+    def save(self, path: Path) -> None:
+        tensors: Dict[str, torch.Tensor] = {}
+        for kind, segments in (("prompt", self._prompt), ("negative", self._negative)):
+            for preset_id, seg in segments.items():
+                tensors[f"{preset_id}/{kind}/prefix"] = seg.prefix.detach().cpu().contiguous()
+                tensors[f"{preset_id}/{kind}/full"] = seg.full.detach().cpu().contiguous()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        save_file(tensors, str(path), metadata={"info": json.dumps(self.info)})
+
+    @classmethod
+    def load(cls, model_id: str, path: Path, device: torch.device) -> "PresetEmbeddingBank":
+        from safetensors import safe_open
+
+        bank = cls(model_id)
+        with safe_open(str(path), framework="pt") as f:
+            bank.info = json.loads((f.metadata() or {}).get("info", "{}"))
+        tensors = load_file(str(path), device=str(device))
+        for name in tensors:
+            preset_id, kind, part = name.rsplit("/", 2)
+            if part != "prefix":
+                continue
+            seg = _Segment(prefix=tensors[name], full=tensors[f"{preset_id}/{kind}/full"])
+            (bank._prompt if kind == "prompt" else bank._negative)[preset_id] = seg
+        return bank
+
+
+def validate_preset(pipe, bank: PresetEmbeddingBank, preset: StylePreset) -> float:
+    """Worst mean cosine similarity between fast and string composition over probe prompts."""
+
+    worst = 1.0
+    for base_prompt in _PROBE_PROMPTS:
+        for base_negative in _PROBE_NEGATIVES:
+            fast_prompt, fast_negative = bank.compose(
+                pipe, PresetComposition(preset.id, base_prompt, base_negative)
+            )
+            ref_prompt = encode_text(pipe, compose_prompt(base_prompt, preset))
+            ref_negative = encode_text(pipe, build_negative_prompt(base_negative, preset))
+            worst = min(worst, _cosine(fast_prompt[0], ref_prompt), _cosine(fast_negative[0], ref_negative))
+    return worst
+
+
+_BANKS: Dict[Tuple[str, str], PresetEmbeddingBank] = {}
+_BANKS_LOCK = threading.Lock()
+
+
+def bank_path(model_id: str, dtype: torch.dtype) -> Path:
+    return BANK_ROOT / f"{_slug(model_id)}--{str(dtype).replace('torch.', '')}.safetensors"
+
+
+def get_preset_bank(pipe, model_id: str) -> PresetEmbeddingBank:
+    """Load (or build and persist) the bank for ``model_id``; cached per process."""
+
+    dtype = pipe.text_encoder.dtype
+    key = (model_id, str(dtype))
+    with _BANKS_LOCK:
+        bank = _BANKS.get(key)
+        if bank is not None:
+            return bank
+
+        path = bank_path(model_id, dtype)
+        if path.exists():
+            bank = PresetEmbeddingBank.load(model_id, path, pipe.text_encoder.device)
+        else:
+            bank = PresetEmbeddingBank(model_id)
+        if bank.build(pipe):
+            bank.save(path)
+
+        _BANKS[key] = bank
+        return bank
+
+
+def benchmark_encode(pipe, model_id: str, runs: int = 5) -> Dict[str, float]:
+    """Mean text-encoding time per request for string vs bank composition, in ms."""
+
+    bank = get_preset_bank(pipe, model_id)
+    requests = [
+        (preset, base_prompt, base_negative)
+        for preset in list_presets()
+        if bank.is_usable(preset.id)
+        for base_prompt in _PROBE_PROMPTS
+        for base_negative in _PROBE_NEGATIVES
+    ]
+    if not requests:
+        return {"requests": 0}
+
+    def _time(fn) -> float:
+        t0 = perf_counter()
+        for _ in range(runs):
+            for preset, base_prompt, base_negative in requests:
+                fn(preset, base_prompt, base_negative)
+        return (perf_counter() - t0) * 1000 / (runs * len(requests))
+
+    string_ms = _time(
+        lambda preset, p, n: (
+            encode_text(pipe, compose_prompt(p, preset)),
+            encode_text(pipe, build_negative_prompt(n, preset)),
+        )
+    )
+    bank_ms = _time(lambda preset, p, n: bank.compose(pipe, PresetComposition(preset.id, p, n)))
+    return {"requests": len(requests), "string_ms": string_ms, "bank_ms": bank_ms, "saved_ms": string_ms - bank_ms}
+
+
+def main(argv: Optional[list] = None) -> None:
+    from src.generation.pipeline import SDConfig, SDMPSPipeline
+
+    parser = argparse.ArgumentParser(description="Build and benchmark the preset embedding bank")
+    parser.add_argument("model_id", nargs="?", default=SDConfig.model_id)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    pipe = SDMPSPipeline(SDConfig(model_id=args.model_id)).pipe
+    bank = get_preset_bank(pipe, args.model_id)
+    print(json.dumps({"similarity": {k: v["similarity"] for k, v in bank.info.items()}}, indent=2))
+    print(json.dumps(benchmark_encode(pipe, args.model_id, runs=args.runs), indent=2))
+
+
+__all__ = [
+    "PresetComposition",
+    "PresetEmbeddingBank",
+    "MIN_SIMILARITY",
+    "encode_text",
+    "validate_preset",
+    "get_preset_bank",
+    "bank_path",
+    "benchmark_encode",
+]
+
+
+if __name__ == "__main__":
+    main()
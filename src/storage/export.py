@@ -0,0 +1,404 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from . import store
+from .latents import LATENT_SUFFIX
+from .manifest import open_manifest
+from .store import GenerationRecord, record_date
+
+
+EXPORT_FORMATS = ("zip", "tar", "wds")
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# Per-member checksum in tar PAX headers, so tar imports can verify while streaming.
+_PAX_SHA256 = "DREAMCANVAS.sha256"
+
+_CHUNK = 1024 * 1024
+
+# What an imported member may be called; anything else is rejected, never written.
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_ID_RE = re.compile(r"[A-Za-z0-9_-]+")
+_IMPORT_SUFFIXES = frozenset((".png", LATENT_SUFFIX, ".json"))
+
+
+@dataclass
+class ExportResult:
+    paths: List[Path]
+    records: int
+    bytes: int
+
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    skipped: int = 0
+    failed: List[str] = field(default_factory=list)
+
+
+def _record_files(record: GenerationRecord) -> List[Tuple[str, Path]]:
+    """(suffix, path) pairs to archive for a record; the sidecar goes last."""
+
+    files = [(".png", Path(record.image_path))]
+    if record.latent_path and Path(record.latent_path).exists():
+        files.append((LATENT_SUFFIX, Path(record.latent_path)))
+    files.append((".json", Path(record.metadata_path)))
+    return files
+
+
+def _sha256(path: Path) -> Tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with path.open("rb") as f:
+        while True:
+            chunk = f.read(_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _sidecar_bytes(record: GenerationRecord) -> Optional[bytes]:
+    """The JSON sidecar of a manifest-only record, built in memory; None if it is on disk."""
+
+    if Path(record.metadata_path).exists():
+        return None
+    # Same layout as the sidecars save_generation writes.
+    return json.dumps(store.load_metadata(record), indent=2).encode("utf-8")
+
+
+def _hash_record(record: GenerationRecord) -> Tuple[Dict[str, object], Optional[bytes]]:
+    # Archives always carry JSON sidecars, also for manifest-only records; those
+    # are built in memory so exporting never writes into the output tree.
+    sidecar = _sidecar_bytes(record)
+    files = {}
+    for suffix, path in _record_files(record):
+        if suffix == ".json" and sidecar is not None:
+            sha, size = hashlib.sha256(sidecar).hexdigest(), len(sidecar)
+        else:
+            sha, size = _sha256(path)
+        files[suffix] = {"sha256": sha, "size": size}
+    return {"id": record.id, "date": record_date(record), "files": files}, sidecar
+
+
+def _prefetched(
+    records: Sequence[GenerationRecord],
+    pool: ThreadPoolExecutor,
+    window: int,
+) -> Iterator[Tuple[GenerationRecord, Tuple[Dict[str, object], Optional[bytes]]]]:
+    # Hash a bounded window of records ahead of the writer: the reads run in
+    # parallel and leave the files hot in the page cache for the sequential copy.
+    pending: Deque[Tuple[GenerationRecord, Future]] = deque()
+    it = iter(records)
+    for record in it:
+        pending.append((record, pool.submit(_hash_record, record)))
+        if len(pending) >= window:
+            break
+    while pending:
+        record, future = pending.popleft()
+        nxt = next(it, None)
+        if nxt is not None:
+            pending.append((nxt, pool.submit(_hash_record, nxt)))
+        yield record, future.result()
+
+
+def _archive_name(record: GenerationRecord, suffix: str, fmt: str) -> str:
+    if fmt == "wds":
+        # WebDataset groups files by the basename up to the first dot.
+        return f"{record_date(record)}_{record.id}{suffix}"
+    return f"{record_date(record)}/{record.id}{suffix}"
+
+
+class _Writer:
+    def __init__(self, path: Path, fmt: str) -> None:
+        self.fmt = fmt
+        if fmt == "zip":
+            # PNG and npz are already compressed; store them as-is.
+            self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        else:
+            self._tar = tarfile.open(path, "w", format=tarfile.PAX_FORMAT)
+
+    def add_file(self, src: Path, arcname: str, sha256: str) -> None:
+        # Both writers copy the file in chunks; nothing is decoded or held in memory.
+        if self.fmt == "zip":
+            self._zip.write(src, arcname)
+            return
+        info = self._tar.gettarinfo(str(src), arcname=arcname)
+        info.pax_headers = {_PAX_SHA256: sha256}
+        with src.open("rb") as f:
+            self._tar.addfile(info, f)
+
+    def add_stream(self, f: IO[bytes], arcname: str, size: int, sha256: Optional[str] = None) -> None:
+        if self.fmt == "zip":
+            with self._zip.open(arcname, "w", force_zip64=True) as out:
+                shutil.copyfileobj(f, out, _CHUNK)
+        else:
+            info = tarfile.TarInfo(arcname)
+            info.size = size
+            if sha256 is not None:
+                info.pax_headers = {_PAX_SHA256: sha256}
+            self._tar.addfile(info, f)
+
+    def close(self) -> None:
+        if self.fmt == "zip":
+            self._zip.close()
+        else:
+            self._tar.close()
+
+
+def _write_archive(
+    path: Path,
+    records: Sequence[GenerationRecord],
+    fmt: str,
+    pool: ThreadPoolExecutor,
+    window: int,
+) -> int:
+    tmp = path.with_name(f".{path.name}.tmp")
+    total = 0
+    writer = _Writer(tmp, fmt)
+    # The manifest is spooled to disk so memory stays flat for any archive size.
+    with tempfile.TemporaryFile() as manifest:
+        try:
+            for record, (entry, sidecar) in _prefetched(records, pool, window):
+                for suffix, src in _record_files(record):
+                    file_info = entry["files"][suffix]  # type: ignore[index]
+                    arcname = _archive_name(record, suffix, fmt)
+                    if suffix == ".json" and sidecar is not None:
+                        writer.add_stream(io.BytesIO(sidecar), arcname, len(sidecar), file_info["sha256"])
+                    else:
+                        writer.add_file(src, arcname, file_info["sha256"])
+                    total += file_info["size"]
+                manifest.write((json.dumps(entry) + "\n").encode("utf-8"))
+
+            size = manifest.tell()
+            manifest.seek(0)
+            writer.add_stream(manifest, MANIFEST_NAME, size)
+        finally:
+            writer.close()
+    os.replace(tmp, path)
+    return total
+
+
+def export_archive(
+    records: Iterable[GenerationRecord],
+    dest: Path,
+    *,
+    fmt: str = "zip",
+    threads: int = 4,
+    shard_size: int = 1000,
+) -> ExportResult:
+    """Export records (e.g. a ``list_generations`` result) with their sidecars.
+
+    - ``zip`` / ``tar``: a single archive at ``dest`` with ``<date>/<id>.png``,
+      ``.latents.npz`` (if stored) and ``.json`` entries.
+    - ``wds``: WebDataset-style tar shards ``dest/shard-000000.tar`` with
+      ``<date>_<id>.*`` keys and ``shard_size`` records each, written in parallel.
+
+    Files are copied byte-for-byte from disk (no image decode/re-encode) and each
+    archive ends with a ``manifest.jsonl`` of sizes and SHA-256 hashes used by
+    :func:`import_archive`. Memory use does not grow with the archive size.
+    """
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}. Allowed: {', '.join(EXPORT_FORMATS)}")
+
+    records = list(records)
+    dest = Path(dest)
+    threads = max(1, threads)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        if fmt != "wds":
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            total = _write_archive(dest, records, fmt, pool, window=threads * 4)
+            return ExportResult(paths=[dest], records=len(records), bytes=total)
+
+        dest.mkdir(parents=True, exist_ok=True)
+        shards = [records[i : i + shard_size] for i in range(0, len(records), shard_size)]
+        paths = [dest / f"shard-{n:06d}.tar" for n in range(len(shards))]
+        # Shard writers run in their own pool and share the hashing pool.
+        with ThreadPoolExecutor(max_workers=threads) as writers:
+            futures = [
+                writers.submit(_write_archive, path, shard, "wds", pool, 2)
+                for path, shard in zip(paths, shards)
+            ]
+            total = sum(f.result() for f in futures)
+        return ExportResult(paths=paths, records=len(records), bytes=total)
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+
+def _split_name(name: str, fmt: str) -> Optional[Tuple[str, str, str]]:
+    """Archive member name -> (date, id, suffix), or None if it is not a record file.
+
+    Only ``YYYY-MM-DD`` dates, plain ids (no separators or dots) and the record
+    suffixes are accepted, so a member can never name a path outside its day.
+    """
+
+    if fmt == "wds":
+        base = name.rsplit("/", 1)[-1]
+        key, dot, ext = base.partition(".")
+        date, _, rec_id = key.partition("_")
+    else:
+        date, _, base = name.partition("/")
+        rec_id, dot, ext = base.partition(".")
+    if not dot or not _DATE_RE.fullmatch(date) or not _ID_RE.fullmatch(rec_id):
+        return None
+    suffix = f".{ext}"
+    if suffix not in _IMPORT_SUFFIXES:
+        return None
+    return date, rec_id, suffix
+
+
+def _copy_verified(src: IO[bytes], dest: Path, expected: Optional[str]) -> None:
+    tmp = dest.with_name(f".{dest.name}.tmp")
+    digest = hashlib.sha256()
+    with tmp.open("wb") as out:
+        while True:
+            chunk = src.read(_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    if expected is not None and digest.hexdigest() != expected:
+        tmp.unlink()
+        raise ValueError(f"checksum mismatch for {dest.name}")
+    os.replace(tmp, dest)
+
+
+def _iter_members(path: Path, fmt: str) -> Iterator[Tuple[str, IO[bytes], Optional[str]]]:
+    """Yield (name, file object, expected sha256) for every file in the archive."""
+
+    if fmt == "zip":
+        with zipfile.ZipFile(path) as zf:
+            # Zip is random access: read the manifest first to get the checksums.
+            expected: Dict[str, str] = {}
+            if MANIFEST_NAME in zf.namelist():
+                with zf.open(MANIFEST_NAME) as mf:
+                    for line in mf:
+                        if line.strip():
+                            entry = json.loads(line)
+                            for suffix, info in entry["files"].items():
+                                expected[f"{entry['date']}/{entry['id']}{suffix}"] = info["sha256"]
+            for info in zf.infolist():
+                if not info.is_dir():
+                    with zf.open(info) as f:
+                        yield info.filename, f, expected.get(info.filename)
+    else:
+        # Streaming mode reads the tar front to back without an index in memory.
+        with tarfile.open(path, "r|*") as tf:
+            for info in tf:
+                if info.isfile():
+                    f = tf.extractfile(info)
+                    if f is not None:
+                        yield info.name, f, info.pax_headers.get(_PAX_SHA256)
+
+
+def _manifest_ids(day_dir: Path) -> Set[str]:
+    reader = open_manifest(day_dir)
+    if reader is None:
+        return set()
+    with reader:
+        return {entry.id for entry in reader.scan()}
+
+
+def _import_one(path: Path, fmt: str, root: Path, result: ImportResult) -> None:
+    root_resolved = root.resolve()
+    # Ids already recorded per day; with sidecars off the manifest is the only record.
+    recorded: Dict[str, Set[str]] = {}
+    for name, f, expected in _iter_members(path, fmt):
+        if name.rsplit("/", 1)[-1] == MANIFEST_NAME:
+            continue
+        parts = _split_name(name, fmt)
+        if parts is None:
+            result.failed.append(f"{name}: not a record file, ignored")
+            continue
+        date, rec_id, suffix = parts
+
+        out_dir = root / date
+        if out_dir.resolve().parent != root_resolved:
+            result.failed.append(f"{name}: outside the output root, ignored")
+            continue
+        json_path = out_dir / f"{rec_id}.json"
+        if date not in recorded:
+            recorded[date] = _manifest_ids(out_dir)
+        # Metadata is written last, so a recorded id marks a fully imported (or local) record.
+        if rec_id in recorded[date] or json_path.exists():
+            if suffix == ".json":
+                result.skipped += 1
+            continue
+
+        try:
+            out_dir.mkdir(parents=True, exist_ok=True)
+            if suffix != ".json":
+                _copy_verified(f, out_dir / f"{rec_id}{suffix}", expected)
+                continue
+
+            raw = f.read()
+            if expected is not None and hashlib.sha256(raw).hexdigest() != expected:
+                raise ValueError(f"checksum mismatch for {json_path.name}")
+            data = json.loads(raw.decode("utf-8"))
+            # Point the sidecar at where the files live now.
+            data["image_path"] = str(out_dir / f"{rec_id}.png")
+            latent_path = out_dir / f"{rec_id}{LATENT_SUFFIX}"
+            if latent_path.exists():
+                data["latent_path"] = str(latent_path)
+            else:
+                data.pop("latent_path", None)
+            if not Path(data["image_path"]).exists():
+                raise ValueError("image missing from archive")
+            store.write_metadata(json_path, data)
+            recorded[date].add(rec_id)
+            result.imported += 1
+        except (ValueError, KeyError, OSError) as e:
+            result.failed.append(f"{date}/{rec_id}: {e}")
+
+
+def import_archive(path: Path, *, root: Optional[Path] = None) -> ImportResult:
+    """Import an archive (or a directory of ``wds`` shards) into the output root.
+
+    Safe to re-run after an interruption: records already in the day manifest
+    (or with a sidecar) are skipped, files are written atomically and checked
+    against the archive manifest, and metadata is written only after its image.
+    Sidecars follow ``DREAMCANVAS_JSON_SIDECARS`` as for new generations.
+    """
+
+    path = Path(path)
+    root = root if root is not None else store.OUTPUT_ROOT
+    result = ImportResult()
+
+    if path.is_dir():
+        for shard in sorted(path.glob("*.tar")):
+            _import_one(shard, "wds", root, result)
+    elif path.suffix == ".zip":
+        _import_one(path, "zip", root, result)
+    else:
+        _import_one(path, "tar", root, result)
+    return result
+
+
+__all__ = [
+    "EXPORT_FORMATS",
+    "MANIFEST_NAME",
+    "ExportResult",
+    "ImportResult",
+    "export_archive",
+    "import_archive",
+]
@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ..metrics import quality
+from . import store
+from .store import GenerationRecord, record_date
+from .watcher import ChangeEvent, GalleryWatcher
+
+
+THUMB_SIZE = 128
+
+METRIC_COLUMNS = ("sharpness", "colorfulness", "brightness", "contrast")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    phash INTEGER NOT NULL,
+    sharpness REAL NOT NULL,
+    colorfulness REAL NOT NULL,
+    brightness REAL NOT NULL,
+    contrast REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_sharpness ON images (sharpness);
+CREATE INDEX IF NOT EXISTS images_colorfulness ON images (colorfulness);
+"""
+
+
+def _cache_root() -> Path:
+    # Dot-prefixed so gallery scans and the watcher ignore it.
+    return store.OUTPUT_ROOT / ".cache"
+
+
+def record_key(record: GenerationRecord) -> str:
+    """Unique across days (ids are only unique within a day)."""
+
+    return f"{record_date(record)}/{record.id}"
+
+
+def _thumb_dir(date: str) -> Path:
+    return _cache_root() / "thumbs" / date
+
+
+def _thumb_path(record: GenerationRecord) -> Path:
+    # Named after the image's mtime and size, so a replaced image never hits a stale thumbnail.
+    st = Path(record.image_path).stat()
+    return _thumb_dir(record_date(record)) / f"{record.id}-{st.st_mtime_ns}-{st.st_size}.npy"
+
+
+def delete_thumbnails(date: str, rec_id: str) -> None:
+    for path in _thumb_dir(date).glob(f"{rec_id}-*.npy"):
+        path.unlink(missing_ok=True)
+
+
+def load_thumbnails(records: Sequence[GenerationRecord]) -> np.ndarray:
+    """[N, THUMB_SIZE, THUMB_SIZE, 3] uint8 analysis thumbnails, cached on disk.
+
+    Thumbnails are squashed to a square so a batch stacks into one array; they
+    are for metrics, not display.
+    """
+
+    out = np.empty((len(records), THUMB_SIZE, THUMB_SIZE, 3), dtype=np.uint8)
+    for i, rec in enumerate(records):
+        path = _thumb_path(rec)
+        if path.exists():
+            out[i] = np.load(path)
+            continue
+        with Image.open(rec.image_path) as img:
+            thumb = img.convert("RGB").resize((THUMB_SIZE, THUMB_SIZE), Image.BOX, reducing_gap=2.0)
+        out[i] = np.asarray(thumb)
+        # Thumbnails of earlier versions of this image are stale now.
+        delete_thumbnails(record_date(rec), rec.id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.save(path, out[i])
+    return out
+
+
+def load_images(records: Sequence[GenerationRecord]) -> np.ndarray:
+    """Full-resolution [N, H, W, 3] uint8 batch; all records must share one size."""
+
+    arrays = []
+    for rec in records:
+        with Image.open(rec.image_path) as img:
+            arrays.append(np.asarray(img.convert("RGB")))
+    return np.stack(arrays)
+
+
+class GalleryIndex:
+    """SQLite index of per-image metrics and perceptual hashes.
+
+    Metrics are computed in batches over cached thumbnails, for new or changed
+    images only. Queries (sorting, near-duplicate search) then run over the
+    stored columns for the whole gallery at once.
+
+    To keep it current, :meth:`attach` it to a :class:`GalleryWatcher` once and
+    call :meth:`flush` to apply the changes queued since; the cost follows the
+    number of changes, not the gallery size. :meth:`sync` compares a full record
+    list against the index instead.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = Path(path) if path is not None else _cache_root() / "index.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        # index key -> record to (re)index, or None to drop; filled by watcher events
+        self._pending: Dict[str, Optional[GenerationRecord]] = {}
+        self._pending_lock = threading.Lock()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def sync(self, records: Iterable[GenerationRecord], *, prune: bool = True, batch_size: int = 256) -> int:
+        """Index records that are missing or whose image changed. Returns how many were.
+
+        With ``prune``, rows for images not in ``records`` are dropped, so pass the
+        full gallery (e.g. ``GalleryWatcher.records()``).
+        """
+
+        current = _with_mtimes(records)
+
+        with self._lock:
+            indexed = dict(self._conn.execute("SELECT key, mtime_ns FROM images").fetchall())
+            todo = [item for item in current if indexed.get(item[0]) != item[2]]
+            self._analyse(todo, batch_size)
+
+            if prune:
+                keep = {key for key, _, _ in current}
+                self._delete([key for key in indexed if key not in keep])
+            self._conn.commit()
+        return len(todo)
+
+    def attach(self, watcher: GalleryWatcher) -> None:
+        """Queue the watcher's change events, then index what it already holds.
+
+        Subscribing first means nothing saved during the initial sync is missed.
+        """
+
+        watcher.subscribe(self._on_change)
+        self.sync(watcher.records())
+
+    def _on_change(self, event: ChangeEvent) -> None:
+        # Watcher keys are sidecar paths: <root>/<date>/<id>.json
+        path = Path(event.key)
+        with self._pending_lock:
+            self._pending[f"{path.parent.name}/{path.stem}"] = event.record
+
+    def flush(self, batch_size: int = 256) -> int:
+        """Apply queued watcher changes; returns how many images were (re)indexed."""
+
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        todo = _with_mtimes(rec for rec in pending.values() if rec is not None)
+        with self._lock:
+            self._analyse(todo, batch_size)
+            self._delete([key for key, rec in pending.items() if rec is None])
+            self._conn.commit()
+        return len(todo)
+
+    def _analyse(self, items: List[Tuple[str, GenerationRecord, int]], batch_size: int) -> None:
+        for start in range(0, len(items), batch_size):
+            chunk = items[start : start + batch_size]
+            stats = quality.image_stats(load_thumbnails([rec for _, rec, _ in chunk]))
+            # SQLite integers are signed 64-bit; store the hash bits as int64.
+            hashes = stats["phash"].view(np.int64)
+            rows = [
+                (
+                    key,
+                    rec.id,
+                    record_date(rec),
+                    mtime,
+                    int(hashes[i]),
+                    *(float(stats[col][i]) for col in METRIC_COLUMNS),
+                )
+                for i, (key, rec, mtime) in enumerate(chunk)
+            ]
+            self._conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _delete(self, keys: List[str]) -> None:
+        self._conn.executemany("DELETE FROM images WHERE key = ?", [(key,) for key in keys])
+        for key in keys:
+            delete_thumbnails(*key.split("/", 1))
+
+    def metrics(self, records: Sequence[GenerationRecord]) -> Dict[str, Dict[str, float]]:
+        """Stored metrics for the given records, keyed by record id."""
+
+        keys = {record_key(r): r.id for r in records}
+        wanted = list(keys)
+        out: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            # Chunked to stay under SQLite's bound-parameter limit.
+            for start in range(0, len(wanted), 500):
+                chunk = wanted[start : start + 500]
+                cursor = self._conn.execute(
+                    f"SELECT key, {', '.join(METRIC_COLUMNS)} FROM images "
+                    f"WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for key, *values in cursor:
+                    out[keys[key]] = dict(zip(METRIC_COLUMNS, values))
+        return out
+
+    def sort(
+        self,
+        records: Sequence[GenerationRecord],
+        metric: str,
+        *,
+        descending: bool = True,
+    ) -> List[GenerationRecord]:
+        """``records`` ordered by a stored metric; unindexed records go last."""
+
+        if metric not in METRIC_COLUMNS:
+            raise ValueError(f"Unknown metric {metric!r}. Allowed: {', '.join(METRIC_COLUMNS)}")
+
+        order = "DESC" if descending else "ASC"
+        with self._lock:
+            ranked = [k for (k,) in self._conn.execute(f"SELECT key FROM images ORDER BY {metric} {order}")]
+        position = {key: i for i, key in enumerate(ranked)}
+        return sorted(records, key=lambda r: position.get(record_key(r), len(position)))
+
+    def near_duplicates(self, max_distance: int = 6, block: int = 128) -> List[List[str]]:
+        """Groups of record keys whose perceptual hashes differ by <= ``max_distance`` bits.
+
+        Distances are computed blockwise over all stored hashes. Each block holds a
+        uint64 XOR plus its popcounts, about ``16 x block x N`` bytes (20 MB per
+        block of 128 at 10,000 images). Groups are connected components of the
+        "close" relation.
+        """
+
+        with self._lock:
+            rows = self._conn.execute("SELECT key, phash FROM images ORDER BY key").fetchall()
+        if len(rows) < 2:
+            return []
+
+        keys = [k for k, _ in rows]
+        hashes = np.array([h for _, h in rows], dtype=np.int64).view(np.uint64)
+
+        parent = np.arange(len(keys))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for start in range(0, len(hashes), block):
+            dist = quality.hamming(hashes[start : start + block], hashes)
+            rows_i, cols_j = np.nonzero(dist <= max_distance)
+            rows_i = rows_i + start
+            # Each unordered pair once.
+            keep = rows_i < cols_j
+            for i, j in zip(rows_i[keep], cols_j[keep]):
+                ri, rj = find(int(i)), find(int(j))
+                if ri != rj:
+                    parent[rj] = ri
+
+        groups: Dict[int, List[str]] = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(find(i), []).append(key)
+        return [g for g in groups.values() if len(g) > 1]
+
+
+def _with_mtimes(records: Iterable[GenerationRecord]) -> List[Tuple[str, GenerationRecord, int]]:
+    """(key, record, image mtime) for records whose image exists."""
+
+    out = []
+    for rec in records:
+        try:
+            out.append((record_key(rec), rec, Path(rec.image_path).stat().st_mtime_ns))
+        except FileNotFoundError:
+            continue
+    return out
+
+
+def compare_records(records: Sequence[GenerationRecord]) -> List[Dict[str, float]]:
+    """SSIM / PSNR of every record against the first one, at full resolution when sizes match."""
+
+    if len(records) < 2:
+        return []
+
+    images = load_thumbnails(records)
+    sizes = set()
+    for rec in records:
+        with Image.open(rec.image_path) as img:
+            sizes.add(img.size)
+    if len(sizes) == 1:
+        images = load_images(records)
+
+    ref = np.repeat(images[:1], len(images) - 1, axis=0)
+    others = images[1:]
+    ssim = quality.ssim(ref, others)
+    psnr = quality.psnr(ref, others)
+    return [
+        {"id": rec.id, "ssim": float(s), "psnr": float(p)}
+        for rec, s, p in zip(records[1:], ssim, psnr)
+    ]
+
+
+__all__ = [
+    "THUMB_SIZE",
+    "METRIC_COLUMNS",
+    "GalleryIndex",
+    "record_key",
+    "load_thumbnails",
+    "load_images",
+    "compare_records",
+]
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+LATENT_SUFFIX = ".latents.npz"
+
+FINAL_KEY = "final"
+
+
+def latent_path_for(json_path: Path) -> Path:
+    """outputs/<YYYY-MM-DD>/<id>.latents.npz next to the record's sidecar."""
+
+    return json_path.with_name(json_path.stem + LATENT_SUFFIX)
+
+
+def save_latents(path: Path, latents: Dict[str, np.ndarray]) -> int:
+    """Write latents as compressed fp16 arrays; returns the file size in bytes.
+
+    ``latents`` maps a name (``"final"``, ``"step_0012"``, ...) to an array shaped
+    [channels, height / 8, width / 8].
+    """
+
+    arrays = {name: np.asarray(arr, dtype=np.float16) for name, arr in latents.items()}
+    tmp = path.with_name(f".{path.name}.tmp")
+    with tmp.open("wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+    return path.stat().st_size
+
+
+def load_latents(path: Path, key: str = FINAL_KEY) -> np.ndarray:
+    with np.load(path) as data:
+        return data[key]
+
+
+def latent_keys(path: Path) -> list:
+    with np.load(path) as data:
+        return sorted(data.files)
+
+
+def latent_store_size(root: Optional[Path] = None) -> Tuple[int, int]:
+    """(number of latent files, total bytes) under the output root."""
+
+    from . import store
+
+    root = root if root is not None else store.OUTPUT_ROOT
+    if not root.exists():
+        return 0, 0
+
+    count = 0
+    total = 0
+    for path in root.glob(f"*/*{LATENT_SUFFIX}"):
+        count += 1
+        total += path.stat().st_size
+    return count, total
+
+
+__all__ = [
+    "LATENT_SUFFIX",
+    "FINAL_KEY",
+    "latent_path_for",
+    "save_latents",
+    "load_latents",
+    "latent_keys",
+    "latent_store_size",
+]
@@ -0,0 +1,396 @@
+"""Append-only binary record manifest, one per day directory.
+
+Layout of ``outputs/<YYYY-MM-DD>/records.manifest``::
+
+    b"DCM2"                                   file magic
+    entry*                                    appended in save order
+
+    entry := u32 marker 0xD5C0E17A, u32 body length, u32 CRC-32 of the body, body
+    body  := i64 seed, u32 steps, f64 guidance_scale, f64 duration_sec, u8 flags
+             str id, str created_at, str preset_id, str prompt,
+             str negative_prompt, str model_id, str device, str extra
+    str   := u32 byte length + UTF-8
+
+``extra`` is compact JSON with every other metadata key (config, height,
+width, profile, ...). The filter fields come first so a reader can stop after
+``prompt``. Paths are not stored; they follow from the day directory and id.
+When an id is appended more than once, the last entry wins.
+
+Appends hold an exclusive ``flock`` and first cut off any torn tail left by an
+interrupted writer. Readers skip entries that fail the bounds or CRC checks
+and resync on the next marker, so damage loses only the damaged entry.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import warnings
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+from .latents import LATENT_SUFFIX
+
+if TYPE_CHECKING:
+    from .store import GenerationRecord
+
+try:  # POSIX advisory locks; without them concurrent appenders are not serialized.
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+DAY_MANIFEST = "records.manifest"
+
+MAGIC = b"DCM2"
+
+_MARKER = 0xD5C0E17A
+_HEADER = struct.Struct("<III")  # marker, body length, CRC-32
+_MARKER_BYTES = _HEADER.pack(_MARKER, 0, 0)[:4]
+_LEN = struct.Struct("<I")
+_FIXED = struct.Struct("<qIddB")
+
+_FLAG_PRESET = 1
+_FLAG_LATENTS = 2
+
+# String fields in entry order; the first four are all filtering needs.
+_STRINGS = ("id", "created_at", "preset_id", "prompt", "negative_prompt", "model_id", "device")
+_FILTER_STRINGS = 4
+
+# Keys stored in the fixed part, the string fields, or derived from the location.
+_CORE_KEYS = frozenset(
+    ("seed", "steps", "guidance_scale", "duration_sec", "image_path", "latent_path") + _STRINGS
+)
+
+
+@dataclass(slots=True)
+class ManifestEntry:
+    """The filter fields of one entry; full metadata is decoded on demand."""
+
+    offset: int
+    end: int  # where the next entry starts
+    id: str
+    created_at: str
+    preset_id: Optional[str]
+    prompt: str
+
+    def matches(self, preset_id: Optional[str] = None, keyword: Optional[str] = None) -> bool:
+        if preset_id and self.preset_id != preset_id:
+            return False
+        if keyword and keyword.lower() not in self.prompt.lower():
+            return False
+        return True
+
+
+def encode_entry(metadata: Dict[str, Any]) -> bytes:
+    """Serialize a stored metadata dict (as written to the JSON sidecar)."""
+
+    flags = 0
+    if metadata.get("preset_id") is not None:
+        flags |= _FLAG_PRESET
+    if metadata.get("latent_path"):
+        flags |= _FLAG_LATENTS
+
+    parts = [
+        _FIXED.pack(
+            int(metadata.get("seed", 0)),
+            int(metadata.get("steps", 0)),
+            float(metadata.get("guidance_scale", 0.0)),
+            float(metadata.get("duration_sec", 0.0)),
+            flags,
+        )
+    ]
+    extra = {k: v for k, v in metadata.items() if k not in _CORE_KEYS}
+    strings = [str(metadata.get(name) or "") for name in _STRINGS]
+    strings.append(json.dumps(extra, separators=(",", ":")))
+    for s in strings:
+        raw = s.encode("utf-8")
+        parts.append(_LEN.pack(len(raw)))
+        parts.append(raw)
+
+    body = b"".join(parts)
+    return _HEADER.pack(_MARKER, len(body), zlib.crc32(body)) + body
+
+
+def _complete_end(buf: Any) -> int:
+    """Offset just past the last entry whose header and length fit in ``buf``.
+
+    Appends always start here, so a torn entry can only ever be at the tail.
+    """
+
+    pos = len(MAGIC)
+    end = len(buf)
+    while pos + _HEADER.size <= end:
+        marker, length, _ = _HEADER.unpack_from(buf, pos)
+        if marker != _MARKER or pos + _HEADER.size + length > end:
+            break
+        pos += _HEADER.size + length
+    return pos
+
+
+def append_entry(day_dir: Path, metadata: Dict[str, Any]) -> None:
+    """Append one record to the day's manifest, creating it if needed."""
+
+    entry = encode_entry(metadata)
+    with (day_dir / DAY_MANIFEST).open("a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)  # released when the file closes
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            f.write(MAGIC + entry)
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            end = _complete_end(buf)
+        if end < size:
+            # Damaged: keep intact entries after the damage (found by resyncing)
+            # and drop only what an interrupted writer left at the tail.
+            with ManifestReader(f.name) as reader:
+                for item in reader.scan(end):
+                    end = item.end
+            f.truncate(end)
+        f.write(entry)
+
+
+class ManifestReader:
+    """Memory-mapped reader for one day manifest; use as a context manager."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.day_dir = self.path.parent
+        self._file = self.path.open("rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._buf: Any = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        if size and self._buf[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not a record manifest")
+
+    @property
+    def size(self) -> int:
+        return len(self._buf)
+
+    def close(self) -> None:
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._file.close()
+
+    def __enter__(self) -> "ManifestReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _string(self, pos: int, limit: int) -> Tuple[str, int]:
+        if pos + _LEN.size > limit:
+            raise ValueError("string header past the end of its entry")
+        (n,) = _LEN.unpack_from(self._buf, pos)
+        pos += _LEN.size
+        if pos + n > limit:
+            raise ValueError("string past the end of its entry")
+        return bytes(self._buf[pos : pos + n]).decode("utf-8"), pos + n
+
+    def _entry(self, pos: int) -> Optional[ManifestEntry]:
+        # None if the bytes at ``pos`` are not a complete, intact entry.
+        buf = self._buf
+        if pos + _HEADER.size > len(buf):
+            return None
+        marker, length, crc = _HEADER.unpack_from(buf, pos)
+        body = pos + _HEADER.size
+        end = body + length
+        if marker != _MARKER or end > len(buf) or length < _FIXED.size:
+            return None
+        if zlib.crc32(buf[body:end]) != crc:
+            return None
+        try:
+            flags = buf[body + _FIXED.size - 1]
+            cursor = body + _FIXED.size
+            values = []
+            for _ in range(_FILTER_STRINGS):
+                value, cursor = self._string(cursor, end)
+                values.append(value)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        rec_id, created_at, preset_id, prompt = values
+        return ManifestEntry(
+            offset=pos,
+            end=end,
+            id=rec_id,
+            created_at=created_at,
+            preset_id=preset_id if flags & _FLAG_PRESET else None,
+            prompt=prompt,
+        )
+
+    def scan(self, start: int = 0) -> Iterator[ManifestEntry]:
+        """Entries from byte ``start`` on (0 = beginning), decoding only filter fields.
+
+        Damaged bytes (a torn or corrupted entry) are skipped up to the next
+        entry marker.
+        """
+
+        buf = self._buf
+        pos = max(start, len(MAGIC))
+        while pos + _HEADER.size <= len(buf):
+            entry = self._entry(pos)
+            if entry is None:
+                pos = buf.find(_MARKER_BYTES, pos + 1)
+                if pos < 0:
+                    return
+                continue
+            yield entry
+            pos = entry.end
+
+    def latest(self, start: int = 0) -> List[ManifestEntry]:
+        """Entries with duplicates removed (the last append of an id wins)."""
+
+        by_id: Dict[str, ManifestEntry] = {}
+        for entry in self.scan(start):
+            by_id.pop(entry.id, None)
+            by_id[entry.id] = entry
+        return list(by_id.values())
+
+    def _core(self, offset: int) -> Tuple[Tuple[int, int, float, float, int], Dict[str, str], int, int]:
+        # Fixed fields, string fields, and where ``extra`` starts and the entry ends.
+        _, length, _ = _HEADER.unpack_from(self._buf, offset)
+        body = offset + _HEADER.size
+        end = body + length
+        fixed = _FIXED.unpack_from(self._buf, body)
+        cursor = body + _FIXED.size
+        strings: Dict[str, str] = {}
+        for name in _STRINGS:
+            strings[name], cursor = self._string(cursor, end)
+        return fixed, strings, cursor, end
+
+    def record(self, offset: int) -> "GenerationRecord":
+        """The gallery record of the entry at ``offset``, without decoding ``extra``."""
+
+        from .store import GenerationRecord
+
+        (seed, steps, guidance, duration, flags), strings, _, _ = self._core(offset)
+        rec_id = strings["id"]
+        return GenerationRecord(
+            id=rec_id,
+            created_at=strings["created_at"],
+            image_path=str(self.day_dir / f"{rec_id}.png"),
+            metadata_path=str(self.day_dir / f"{rec_id}.json"),
+            prompt=strings["prompt"],
+            negative_prompt=strings["negative_prompt"],
+            preset_id=strings["preset_id"] if flags & _FLAG_PRESET else None,
+            seed=seed,
+            steps=steps,
+            guidance_scale=guidance,
+            model_id=strings["model_id"],
+            device=strings["device"],
+            duration_sec=duration,
+            latent_path=str(self.day_dir / f"{rec_id}{LATENT_SUFFIX}") if flags & _FLAG_LATENTS else None,
+        )
+
+    def metadata(self, offset: int) -> Dict[str, Any]:
+        """Full metadata of the entry at ``offset``, in the JSON sidecar's shape."""
+
+        (seed, steps, guidance, duration, flags), strings, cursor, end = self._core(offset)
+        data: Dict[str, Any] = dict(strings)
+        extra, _ = self._string(cursor, end)
+
+        if not flags & _FLAG_PRESET:
+            data["preset_id"] = None
+        data.update(
+            seed=seed,
+            steps=steps,
+            guidance_scale=guidance,
+            duration_sec=duration,
+            image_path=str(self.day_dir / f"{data['id']}.png"),
+        )
+        if flags & _FLAG_LATENTS:
+            data["latent_path"] = str(self.day_dir / f"{data['id']}{LATENT_SUFFIX}")
+        data.update(json.loads(extra))
+        return data
+
+    def find(self, rec_id: str) -> Optional[int]:
+        """Offset of the latest entry for ``rec_id``, if any."""
+
+        found = None
+        for entry in self.scan():
+            if entry.id == rec_id:
+                found = entry.offset
+        return found
+
+
+def open_manifest(day_dir: Path) -> Optional[ManifestReader]:
+    """Reader for a day's manifest, or None if it is missing or not a manifest.
+
+    An unreadable file is reported and otherwise ignored, so the day's JSON
+    sidecars are still listed.
+    """
+
+    path = Path(day_dir) / DAY_MANIFEST
+    try:
+        return ManifestReader(path)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        warnings.warn(f"Ignoring record manifest: {e}")
+        return None
+
+
+def rebuild_manifest(day_dir: Path) -> int:
+    """Rewrite a day's manifest from its JSON sidecars; returns the number of entries.
+
+    For days saved before manifests existed, or to compact one with repeated
+    ids. Sidecars take precedence; existing entries without a sidecar are kept.
+    The new file replaces the old one atomically.
+    """
+
+    day_dir = Path(day_dir)
+    path = day_dir / DAY_MANIFEST
+    entries: Dict[str, bytes] = {}
+    reader = open_manifest(day_dir)
+    if reader is not None:
+        with reader:
+            for item in reader.latest():
+                entries[item.id] = bytes(reader._buf[item.offset : item.end])
+    for json_path in sorted(day_dir.glob("[!.]*.json")):
+        with json_path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        entries.pop(str(data["id"]), None)
+        entries[str(data["id"])] = encode_entry(data)
+
+    tmp = path.with_name(f".{path.name}.tmp")
+    with tmp.open("wb") as f:
+        f.write(MAGIC)
+        for entry in entries.values():
+            f.write(entry)
+    os.replace(tmp, path)
+    return len(entries)
+
+
+def main(argv: Optional[list] = None) -> None:
+    from . import store
+
+    parser = argparse.ArgumentParser(description="DreamCanvas record manifests")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="build day manifests from JSON sidecars")
+    rebuild.add_argument("root", nargs="?", default=str(store.OUTPUT_ROOT))
+
+    args = parser.parse_args(argv)
+    for day_dir in sorted(Path(args.root).iterdir()):
+        if day_dir.is_dir() and not day_dir.name.startswith("."):
+            print(f"{day_dir.name}: {rebuild_manifest(day_dir)} record(s)")
+
+
+__all__ = [
+    "DAY_MANIFEST",
+    "ManifestEntry",
+    "ManifestReader",
+    "open_manifest",
+    "encode_entry",
+    "append_entry",
+    "rebuild_manifest",
+]
+
+
+if __name__ == "__main__":
+    main()
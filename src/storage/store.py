@@ -1,18 +1,27 @@
 from __future__ import annotations
 
 import json
+import os
 from dataclasses import asdict, dataclass
 from datetime import datetime
 from pathlib import Path
+from time import perf_counter
 from typing import Any, Dict, Iterable, List, Optional
 
 from PIL import Image
 
+from .latents import latent_path_for, save_latents
+from .manifest import append_entry, open_manifest
+
 
 OUTPUT_ROOT = Path("outputs")
 
+# Set to 0 to keep records only in the day manifests (exports and imports
+# follow it too; archives still carry sidecars, built in memory).
+SIDECAR_ENV = "DREAMCANVAS_JSON_SIDECARS"
+
 
-@dataclass
+@dataclass(slots=True)
 class GenerationRecord:
     id: str
     created_at: str
@@ -27,6 +36,7 @@ class GenerationRecord:
     model_id: str
     device: str
     duration_sec: float
+    latent_path: Optional[str] = None
 
 
 def _ensure_dir(path: Path) -> None:
@@ -40,14 +50,67 @@ def _today_dir() -> Path:
     return out_dir
 
 
+def _tmp_path(path: Path) -> Path:
+    # Dot-prefixed so scanners and watchers skip files that are still being written.
+    return path.with_name(f".{path.name}.tmp")
+
+
+def _write_json_atomic(path: Path, data: Dict[str, Any]) -> None:
+    tmp = _tmp_path(path)
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def json_sidecars_enabled() -> bool:
+    return os.environ.get(SIDECAR_ENV, "1") != "0"
+
+
+def write_metadata(json_path: Path, metadata: Dict[str, Any]) -> None:
+    """Record a saved image: append to its day manifest and, unless disabled, write the sidecar.
+
+    Call after the image (and latents) are in place; this is what makes a record visible.
+    """
+
+    append_entry(json_path.parent, metadata)
+    if json_sidecars_enabled():
+        _write_json_atomic(json_path, metadata)
+
+
+def _store_profile(profile: Dict[str, Any], json_path: Path, png_encode_sec: float) -> Dict[str, Any]:
+    stored: Dict[str, Any] = {"stages": {**profile.get("stages", {}), "png_encode": png_encode_sec}}
+    for key, suffix in (("trace", ".trace.json.gz"), ("stacks", ".stacks.folded")):
+        data = profile.get(key)
+        if not data:
+            continue
+        dest = json_path.with_name(f"{json_path.stem}{suffix}")
+        tmp = _tmp_path(dest)
+        tmp.write_bytes(data)
+        os.replace(tmp, dest)
+        stored[key] = str(dest)
+    return stored
+
+
 def save_generation(
     image: Image.Image,
     metadata: Dict[str, Any],
     preset_id: Optional[str] = None,
 ) -> GenerationRecord:
-    """Persist a single generation as PNG + JSON sidecar.
+    """Persist a single generation as PNG + manifest entry (+ JSON sidecar).
+
+    Layout: outputs/<YYYY-MM-DD>/<id>.png, an entry appended to
+    outputs/<YYYY-MM-DD>/records.manifest and, unless DREAMCANVAS_JSON_SIDECARS=0,
+    <id>.json.
 
-    Layout: outputs/<YYYY-MM-DD>/<id>.png and <id>.json
+    The PNG is written under a temporary name and renamed into place before the
+    metadata is written, so visible metadata always has its complete image.
+
+    If ``metadata["latents"]`` holds captured latents (name -> array), they are
+    written to <id>.latents.npz instead of the sidecar.
+
+    If ``metadata["profile"]`` holds profiling artifacts, they are written to
+    <id>.trace.json.gz / <id>.stacks.folded and the PNG encode time is added to
+    its stage timings.
     """
 
     out_dir = _today_dir()
@@ -60,8 +123,16 @@ def save_generation(
     img_path = out_dir / f"{file_stem}.png"
     json_path = out_dir / f"{file_stem}.json"
 
+    metadata = dict(metadata)
+    latents = metadata.pop("latents", None)
+    profile = metadata.pop("profile", None)
+
     # Save image
-    image.save(img_path, format="PNG")
+    t0 = perf_counter()
+    tmp_img_path = _tmp_path(img_path)
+    image.save(tmp_img_path, format="PNG")
+    os.replace(tmp_img_path, img_path)
+    png_encode_sec = perf_counter() - t0
 
     # Merge metadata with storage fields
     stored_metadata = {
@@ -72,42 +143,75 @@ def save_generation(
         "preset_id": preset_id,
     }
 
-    with json_path.open("w", encoding="utf-8") as f:
-        json.dump(stored_metadata, f, indent=2)
+    if latents:
+        latent_path = latent_path_for(json_path)
+        stored_metadata["latent_path"] = str(latent_path)
+        stored_metadata["latent_bytes"] = save_latents(latent_path, latents)
 
-    record = GenerationRecord(
-        id=file_stem,
-        created_at=created_at,
-        image_path=str(img_path),
-        metadata_path=str(json_path),
-        prompt=stored_metadata.get("prompt", ""),
-        negative_prompt=stored_metadata.get("negative_prompt", ""),
-        preset_id=preset_id,
-        seed=int(stored_metadata.get("seed", 0)),
-        steps=int(stored_metadata.get("steps", 0)),
-        guidance_scale=float(stored_metadata.get("guidance_scale", 0.0)),
-        model_id=stored_metadata.get("model_id", ""),
-        device=stored_metadata.get("device", ""),
-        duration_sec=float(stored_metadata.get("duration_sec", 0.0)),
-    )
+    if profile:
+        stored_metadata["profile"] = _store_profile(profile, json_path, png_encode_sec)
+
+    write_metadata(json_path, stored_metadata)
 
-    return record
+    return record_from_metadata(stored_metadata, json_path)
 
 
-def _iter_metadata_files() -> Iterable[Path]:
+def _iter_day_dirs() -> Iterable[Path]:
     if not OUTPUT_ROOT.exists():
         return []
     for day_dir in sorted(OUTPUT_ROOT.iterdir()):
-        if not day_dir.is_dir():
+        # Dot directories (e.g. ``.cache``) hold derived data, not records.
+        if not day_dir.is_dir() or day_dir.name.startswith("."):
+            continue
+        yield day_dir
+
+
+def _day_records(
+    day_dir: Path,
+    *,
+    preset_id: Optional[str] = None,
+    keyword: Optional[str] = None,
+) -> List[GenerationRecord]:
+    """Records of one day: from the manifest, plus sidecars it does not cover.
+
+    Manifest entries are filtered on their lightly decoded fields before a
+    record is built from the fixed fields (the JSON ``extra`` part is not
+    parsed), and count only while their PNG exists (deleting the PNG
+    deletes the record). Sidecars of ids missing from the manifest (days saved
+    before manifests, or written by other tools) are parsed as before.
+    """
+
+    pngs = set()
+    sidecars: Dict[str, Path] = {}
+    for entry in day_dir.iterdir():
+        if entry.name.startswith("."):
             continue
-        for json_path in sorted(day_dir.glob("*.json")):
-            yield json_path
+        if entry.suffix == ".png":
+            pngs.add(entry.stem)
+        elif entry.suffix == ".json":
+            sidecars[entry.stem] = entry
+
+    out: List[GenerationRecord] = []
+    reader = open_manifest(day_dir)
+    if reader is not None:
+        with reader:
+            for item in reader.latest():
+                sidecars.pop(item.id, None)
+                if item.id in pngs and item.matches(preset_id, keyword):
+                    out.append(reader.record(item.offset))
+
+    for _, json_path in sorted(sidecars.items()):
+        out.append(load_record(json_path))
+    return out
 
 
 def load_record(json_path: Path) -> GenerationRecord:
     with json_path.open("r", encoding="utf-8") as f:
         data = json.load(f)
+    return record_from_metadata(data, json_path)
+
 
+def record_from_metadata(data: Dict[str, Any], json_path: Path) -> GenerationRecord:
     image_path = Path(data["image_path"])
     return GenerationRecord(
         id=str(data["id"]),
@@ -123,6 +227,7 @@ def load_record(json_path: Path) -> GenerationRecord:
         model_id=data.get("model_id", ""),
         device=data.get("device", ""),
         duration_sec=float(data.get("duration_sec", 0.0)),
+        latent_path=data.get("latent_path"),
     )
 
 
@@ -135,23 +240,55 @@ def list_generations(
     """List generations with optional filters by preset, date, and prompt keyword."""
 
     records: List[GenerationRecord] = []
-
-    for json_path in _iter_metadata_files():
-        if date and json_path.parent.name != date:
+    for day_dir in _iter_day_dirs():
+        if date and day_dir.name != date:
             continue
+        records.extend(_day_records(day_dir, preset_id=preset_id, keyword=keyword))
+    return filter_records(records, preset_id=preset_id, keyword=keyword)
+
+
+def load_metadata(record: GenerationRecord) -> Dict[str, Any]:
+    """Full stored metadata of a record (config, profile, ...), as in its JSON sidecar."""
 
-        rec = load_record(json_path)
+    json_path = Path(record.metadata_path)
+    reader = open_manifest(json_path.parent)
+    if reader is not None:
+        with reader:
+            offset = reader.find(record.id)
+            if offset is not None:
+                return reader.metadata(offset)
+    with json_path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def record_date(record: GenerationRecord) -> str:
+    """The <YYYY-MM-DD> directory a record is stored under."""
+
+    return Path(record.metadata_path).parent.name
 
+
+def filter_records(
+    records: Iterable[GenerationRecord],
+    *,
+    preset_id: Optional[str] = None,
+    date: Optional[str] = None,
+    keyword: Optional[str] = None,
+) -> List[GenerationRecord]:
+    """Apply the gallery filters to already-loaded records, most recent first."""
+
+    out: List[GenerationRecord] = []
+    for rec in records:
+        if date and record_date(rec) != date:
+            continue
         if preset_id and rec.preset_id != preset_id:
             continue
         if keyword and keyword.lower() not in rec.prompt.lower():
             continue
-
-        records.append(rec)
+        out.append(rec)
 
     # Most recent first
-    records.sort(key=lambda r: (r.created_at, r.id), reverse=True)
-    return records
+    out.sort(key=lambda r: (r.created_at, r.id), reverse=True)
+    return out
 
 
 def load_image(record: GenerationRecord) -> Image.Image:
@@ -166,6 +303,13 @@ __all__ = [
     "GenerationRecord",
     "save_generation",
     "list_generations",
+    "filter_records",
+    "load_record",
+    "load_metadata",
+    "json_sidecars_enabled",
+    "write_metadata",
+    "record_from_metadata",
+    "record_date",
     "load_image",
     "record_to_dict",
 ]
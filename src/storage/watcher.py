@@ -0,0 +1,326 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from . import store
+from .manifest import DAY_MANIFEST, open_manifest
+from .store import GenerationRecord, filter_records, load_record
+
+try:  # Optional: native change notifications (inotify / FSEvents / ReadDirectoryChangesW).
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover - polling fallback
+    FileSystemEventHandler = object  # type: ignore[assignment,misc]
+    Observer = None
+
+
+@dataclass
+class ChangeEvent:
+    """A record appearing, changing or disappearing under the output root."""
+
+    kind: str  # "added" | "updated" | "removed"
+    key: str  # sidecar path, unique across days
+    record: Optional[GenerationRecord] = None
+
+
+@dataclass
+class _DirState:
+    mtime_ns: int = -1
+    # sidecar path -> (mtime_ns, size) of the last successfully parsed version,
+    # or (-1, entry offset) for records taken from the manifest
+    sidecars: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+    # id -> (entry offset, record) for everything read from the day manifest so far
+    manifest: Dict[str, Tuple[int, GenerationRecord]] = field(default_factory=dict)
+    # (inode, end of the last complete entry read); appends are read from there
+    manifest_pos: Tuple[int, int] = (-1, 0)
+    # stems first seen with only one half of the PNG/JSON pair -> first seen time
+    unpaired: Dict[str, float] = field(default_factory=dict)
+    # sidecars that failed to parse (probably still being written)
+    retry: bool = False
+
+
+class _DirtyHandler(FileSystemEventHandler):  # type: ignore[misc]
+    def __init__(self, watcher: "GalleryWatcher") -> None:
+        self._watcher = watcher
+
+    def on_any_event(self, event) -> None:  # noqa: ANN001
+        path = Path(getattr(event, "dest_path", "") or event.src_path)
+        self._watcher._mark_dirty(path if event.is_directory else path.parent)
+
+
+class GalleryWatcher:
+    """Incremental view of the records under the output root.
+
+    Keeps records in memory and applies changes as files appear or vanish instead
+    of re-reading every sidecar:
+
+    - Only day directories whose mtime changed (or that native notifications
+      flagged, when ``watchdog`` is installed) are listed again. Only entries
+      appended to the day manifest since the last scan are decoded, and only
+      sidecars not covered by it whose mtime/size changed are parsed again.
+    - A record is exposed once both its PNG and its metadata (manifest entry or
+      JSON) exist. Sidecars that fail to
+      parse are retried on the next poll; halves of a pair that stay alone longer
+      than ``settle_sec`` are reported by :meth:`orphans`.
+
+    Call :meth:`poll` to sync on demand, or :meth:`start` to sync in a background
+    thread. Subscribers receive every :class:`ChangeEvent`.
+    """
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        *,
+        poll_interval: float = 2.0,
+        settle_sec: float = 5.0,
+        use_notifications: bool = True,
+    ) -> None:
+        self.root = Path(root) if root is not None else store.OUTPUT_ROOT
+        self.poll_interval = poll_interval
+        self.settle_sec = settle_sec
+        self.use_notifications = use_notifications and Observer is not None
+
+        self._records: Dict[str, GenerationRecord] = {}
+        self._dirs: Dict[str, _DirState] = {}
+        self._root_mtime_ns = -1
+        self._dirty: Set[str] = set()
+        self._subscribers: List[Callable[[ChangeEvent], None]] = []
+
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+
+    # -- public API ---------------------------------------------------------
+
+    def subscribe(self, callback: Callable[[ChangeEvent], None]) -> None:
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def records(self) -> List[GenerationRecord]:
+        with self._lock:
+            return list(self._records.values())
+
+    def list_generations(
+        self,
+        *,
+        preset_id: Optional[str] = None,
+        date: Optional[str] = None,
+        keyword: Optional[str] = None,
+    ) -> List[GenerationRecord]:
+        """Same filters and ordering as :func:`store.list_generations`, from memory."""
+
+        return filter_records(self.records(), preset_id=preset_id, date=date, keyword=keyword)
+
+    def orphans(self) -> Dict[str, List[str]]:
+        """Stems whose PNG or JSON has been missing for longer than ``settle_sec``."""
+
+        now = time.monotonic()
+        out: Dict[str, List[str]] = {}
+        with self._lock:
+            for day, state in self._dirs.items():
+                stale = [stem for stem, seen in state.unpaired.items() if now - seen >= self.settle_sec]
+                if stale:
+                    out[day] = sorted(stale)
+        return out
+
+    def poll(self) -> List[ChangeEvent]:
+        """Bring the in-memory state up to date and return what changed."""
+
+        with self._lock:
+            events = self._sync()
+            subscribers = list(self._subscribers)
+
+        for event in events:
+            for callback in subscribers:
+                callback(event)
+        return events
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self.poll()
+        if self.use_notifications and self.root.exists():
+            self._observer = Observer()
+            self._observer.schedule(_DirtyHandler(self), str(self.root), recursive=True)
+            self._observer.start()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="gallery-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # -- internals ----------------------------------------------------------
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            # Notifications wake us early; the timeout doubles as the polling fallback
+            # and as the retry tick for partial writes.
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.poll()
+
+    def _mark_dirty(self, path: Path) -> None:
+        with self._lock:
+            self._dirty.add(str(path.resolve()))
+        self._wake.set()
+
+    def _is_dirty(self, path: Path) -> bool:
+        return bool(self._dirty) and str(path.resolve()) in self._dirty
+
+    def _sync(self) -> List[ChangeEvent]:
+        if not self.root.exists():
+            events = [ChangeEvent("removed", key) for key in self._records]
+            self._records.clear()
+            self._dirs.clear()
+            return events
+
+        events: List[ChangeEvent] = []
+        root_mtime = self.root.stat().st_mtime_ns
+        if root_mtime != self._root_mtime_ns or self._is_dirty(self.root):
+            self._root_mtime_ns = root_mtime
+            present = {p.name for p in self.root.iterdir() if p.is_dir() and not p.name.startswith(".")}
+            for gone in set(self._dirs) - present:
+                events.extend(self._drop_dir(gone))
+            for day in present - set(self._dirs):
+                self._dirs[day] = _DirState()
+
+        for day, state in list(self._dirs.items()):
+            day_dir = self.root / day
+            try:
+                mtime = day_dir.stat().st_mtime_ns
+            except FileNotFoundError:
+                events.extend(self._drop_dir(day))
+                continue
+            if mtime == state.mtime_ns and not state.retry and not self._settling(state) and not self._is_dirty(day_dir):
+                continue
+            state.mtime_ns = mtime
+            events.extend(self._scan_dir(day_dir, state))
+
+        self._dirty.clear()
+        return events
+
+    def _settling(self, state: _DirState) -> bool:
+        # Keep rescanning while a lone PNG/JSON may still get its other half.
+        now = time.monotonic()
+        return any(now - seen < self.settle_sec for seen in state.unpaired.values())
+
+    def _drop_dir(self, day: str) -> List[ChangeEvent]:
+        state = self._dirs.pop(day, None)
+        if state is None:
+            return []
+        events = []
+        for key in state.sidecars:
+            if self._records.pop(key, None) is not None:
+                events.append(ChangeEvent("removed", key))
+        return events
+
+    def _read_manifest(self, day_dir: Path, state: _DirState) -> None:
+        path = day_dir / DAY_MANIFEST
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            state.manifest.clear()
+            state.manifest_pos = (-1, 0)
+            return
+
+        ino, end = state.manifest_pos
+        if st.st_ino != ino or st.st_size < end:
+            # Replaced (e.g. rebuilt from sidecars): read it again from the start.
+            state.manifest.clear()
+            end = 0
+        elif st.st_size == end:
+            return
+
+        reader = open_manifest(day_dir)
+        if reader is None:
+            # Not a readable manifest; do not retry until the file changes.
+            state.manifest_pos = (st.st_ino, st.st_size)
+            return
+        with reader:
+            for entry in reader.scan(end):
+                record = reader.record(entry.offset)
+                state.manifest[entry.id] = (entry.offset, record)
+                end = entry.end
+        state.manifest_pos = (st.st_ino, end)
+
+    def _scan_dir(self, day_dir: Path, state: _DirState) -> List[ChangeEvent]:
+        events: List[ChangeEvent] = []
+        self._read_manifest(day_dir, state)
+        pngs: Set[str] = set()
+        jsons: Dict[str, Path] = {}
+        for entry in day_dir.iterdir():
+            if entry.name.startswith("."):
+                continue
+            if entry.suffix == ".png":
+                pngs.add(entry.stem)
+            elif entry.suffix == ".json":
+                jsons[entry.stem] = entry
+
+        state.retry = False
+        now = time.monotonic()
+        described = set(jsons) | set(state.manifest)
+        complete: Set[str] = set()
+        for stem in described | pngs:
+            if stem in described and stem in pngs:
+                state.unpaired.pop(stem, None)
+                complete.add(str(day_dir / f"{stem}.json"))
+            else:
+                state.unpaired.setdefault(stem, now)
+        for stem in list(state.unpaired):
+            if stem not in described and stem not in pngs:
+                del state.unpaired[stem]
+
+        for key in set(state.sidecars) - complete:
+            del state.sidecars[key]
+            if self._records.pop(key, None) is not None:
+                events.append(ChangeEvent("removed", key))
+
+        for key in complete:
+            json_path = Path(key)
+            if json_path.stem in state.manifest:
+                offset, record = state.manifest[json_path.stem]
+                signature = (-1, offset)
+                if state.sidecars.get(key) == signature:
+                    continue
+            else:
+                try:
+                    st = json_path.stat()
+                except FileNotFoundError:
+                    continue
+                signature = (st.st_mtime_ns, st.st_size)
+                if state.sidecars.get(key) == signature:
+                    continue
+                try:
+                    record = load_record(json_path)
+                except (json.JSONDecodeError, KeyError, ValueError):
+                    # Partially written by a non-atomic writer; try again next poll.
+                    state.retry = True
+                    continue
+            kind = "updated" if key in self._records else "added"
+            state.sidecars[key] = signature
+            self._records[key] = record
+            events.append(ChangeEvent(kind, key, record))
+
+        return events
+
+
+__all__ = ["ChangeEvent", "GalleryWatcher"]
@@ -0,0 +1,152 @@
+import zipfile
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from src.storage import store
+from src.storage.export import MANIFEST_NAME, export_archive, import_archive
+from src.storage.manifest import DAY_MANIFEST, ManifestReader
+
+
+@pytest.fixture
+def outputs(tmp_path, monkeypatch):
+    root = tmp_path / "outputs"
+    monkeypatch.setattr(store, "OUTPUT_ROOT", root)
+    return root
+
+
+def _save(n: int):
+    metadata = {
+        "prompt": f"a lighthouse {n}",
+        "negative_prompt": "blurry",
+        "seed": n,
+        "steps": 30,
+        "guidance_scale": 7.5,
+        "model_id": "runwayml/stable-diffusion-v1-5",
+        "device": "mps",
+        "duration_sec": 1.0,
+    }
+    return store.save_generation(Image.new("RGB", (16, 16), (n * 40, 0, 0)), metadata=metadata)
+
+
+def _rewrite_zip(src: Path, dest: Path, replace):
+    # Copy every member, letting ``replace(name, data)`` change names or bytes.
+    with zipfile.ZipFile(src) as zin, zipfile.ZipFile(dest, "w") as zout:
+        for info in zin.infolist():
+            out = replace(info.filename, zin.read(info))
+            if out is not None:
+                zout.writestr(*out)
+
+
+def _manifest_ids(day_dir: Path):
+    with ManifestReader(day_dir / DAY_MANIFEST) as reader:
+        return [entry.id for entry in reader.scan()]
+
+
+@pytest.mark.parametrize("fmt", ["zip", "tar"])
+def test_round_trip(outputs, tmp_path, fmt):
+    saved = [_save(n) for n in range(3)]
+    archive = tmp_path / f"gallery.{fmt}"
+    export_archive(saved, archive, fmt=fmt)
+
+    root = tmp_path / "imported"
+    result = import_archive(archive, root=root)
+    assert (result.imported, result.skipped, result.failed) == (3, 0, [])
+
+    for rec in saved:
+        day = root / store.record_date(rec)
+        assert (day / f"{rec.id}.png").read_bytes() == Path(rec.image_path).read_bytes()
+        assert (day / f"{rec.id}.json").exists()
+
+    # Importing again finds every record in place.
+    again = import_archive(archive, root=root)
+    assert (again.imported, again.skipped) == (0, 3)
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "../escape.png",
+        "2026-01-01/../../escape.png",
+        "/2026-01-01/abs.png",
+        "2026-01-01/run.sh",
+        "2026-01-01/a.b.png",
+        "2026-1-1/short.png",
+    ],
+)
+def test_unsafe_member_names_are_rejected(tmp_path, name):
+    archive = tmp_path / "evil.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr(name, b"payload")
+
+    root = tmp_path / "root" / "outputs"
+    result = import_archive(archive, root=root)
+
+    assert result.imported == 0
+    assert len(result.failed) == 1
+    written = [p for p in tmp_path.rglob("*") if p.is_file() and p != archive]
+    assert written == []
+
+
+def test_checksum_mismatch_is_not_imported(outputs, tmp_path):
+    rec = _save(1)
+    archive = tmp_path / "gallery.zip"
+    export_archive([rec], archive, fmt="zip")
+
+    tampered = tmp_path / "tampered.zip"
+    _rewrite_zip(
+        archive,
+        tampered,
+        lambda name, data: (name, data + b"x" if name.endswith(".png") else data),
+    )
+
+    root = tmp_path / "imported"
+    result = import_archive(tampered, root=root)
+    assert result.imported == 0
+    assert any("checksum mismatch" in f for f in result.failed)
+    day = root / store.record_date(rec)
+    assert not (day / f"{rec.id}.png").exists()
+    assert not (day / f"{rec.id}.json").exists()
+
+
+def test_interrupted_import_resumes(outputs, tmp_path):
+    first, second = _save(1), _save(2)
+    archive = tmp_path / "gallery.zip"
+    export_archive([first, second], archive, fmt="zip")
+
+    # An import cut off after the second record's image, before its sidecar.
+    partial = tmp_path / "partial.zip"
+    _rewrite_zip(
+        archive,
+        partial,
+        lambda name, data: None
+        if name == MANIFEST_NAME or name.endswith(f"{second.id}.json")
+        else (name, data),
+    )
+    root = tmp_path / "imported"
+    assert import_archive(partial, root=root).imported == 1
+
+    result = import_archive(archive, root=root)
+    assert (result.imported, result.skipped, result.failed) == (1, 1, [])
+    day = root / store.record_date(second)
+    assert _manifest_ids(day) == [first.id, second.id]
+
+
+def test_reimport_without_sidecars_keeps_existing_records(outputs, tmp_path, monkeypatch):
+    monkeypatch.setenv(store.SIDECAR_ENV, "0")
+    rec = _save(1)
+    archive = tmp_path / "gallery.zip"
+    export_archive([rec], archive, fmt="zip")
+    day = Path(rec.image_path).parent
+    assert not (day / f"{rec.id}.json").exists()
+
+    # The gallery record changed since the export; the import must not touch it.
+    Image.new("RGB", (16, 16), (0, 0, 255)).save(rec.image_path)
+    local_png = Path(rec.image_path).read_bytes()
+
+    result = import_archive(archive, root=outputs)
+    assert (result.imported, result.skipped) == (0, 1)
+    assert Path(rec.image_path).read_bytes() == local_png
+    assert _manifest_ids(day) == [rec.id]
+    assert not (day / f"{rec.id}.json").exists()
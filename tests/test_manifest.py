@@ -0,0 +1,122 @@
+from pathlib import Path
+
+import pytest
+
+from src.storage.manifest import (
+    DAY_MANIFEST,
+    ManifestReader,
+    append_entry,
+    encode_entry,
+    open_manifest,
+)
+from src.storage.store import record_from_metadata
+
+
+def _metadata(rec_id: str, **extra):
+    return {
+        "id": rec_id,
+        "created_at": "2026-01-01T12:00:00",
+        "image_path": f"outputs/2026-01-01/{rec_id}.png",
+        "prompt": f"a lighthouse {rec_id}",
+        "negative_prompt": "blurry",
+        "preset_id": None,
+        "seed": 1234,
+        "steps": 30,
+        "guidance_scale": 7.3,
+        "model_id": "runwayml/stable-diffusion-v1-5",
+        "device": "mps",
+        "duration_sec": 12.5,
+        **extra,
+    }
+
+
+def _read_all(day_dir: Path):
+    with ManifestReader(day_dir / DAY_MANIFEST) as reader:
+        return [reader.metadata(e.offset) for e in reader.latest()]
+
+
+def test_round_trip(tmp_path):
+    first = _metadata("a", preset_id="noir", config={"height": 512, "nested": [1, 2]})
+    second = _metadata("b", latent_path=str(tmp_path / "b.latents.npz"))
+    append_entry(tmp_path, first)
+    append_entry(tmp_path, second)
+
+    a, b = _read_all(tmp_path)
+    for key in ("id", "created_at", "prompt", "negative_prompt", "preset_id", "seed",
+                "steps", "guidance_scale", "model_id", "device", "duration_sec", "config"):
+        assert a[key] == first[key]
+    assert a["image_path"] == str(tmp_path / "a.png")
+    assert "latent_path" not in a
+    assert b["preset_id"] is None
+    assert b["latent_path"] == str(tmp_path / "b.latents.npz")
+
+
+def test_record_matches_full_metadata(tmp_path):
+    append_entry(tmp_path, _metadata("a", preset_id="noir", config={"height": 512}))
+    append_entry(tmp_path, _metadata("b", latent_path=str(tmp_path / "b.latents.npz")))
+
+    with ManifestReader(tmp_path / DAY_MANIFEST) as reader:
+        for entry in reader.scan():
+            expected = record_from_metadata(reader.metadata(entry.offset), tmp_path / f"{entry.id}.json")
+            assert reader.record(entry.offset) == expected
+
+
+def test_last_append_of_an_id_wins(tmp_path):
+    append_entry(tmp_path, _metadata("a", prompt="old"))
+    append_entry(tmp_path, _metadata("a", prompt="new"))
+
+    (only,) = _read_all(tmp_path)
+    assert only["prompt"] == "new"
+
+
+def test_torn_write_is_cut_off_by_the_next_append(tmp_path):
+    append_entry(tmp_path, _metadata("a"))
+    path = tmp_path / DAY_MANIFEST
+    with path.open("ab") as f:
+        f.write(encode_entry(_metadata("torn"))[:40])  # interrupted writer
+
+    # Readers skip the torn tail ...
+    assert [m["id"] for m in _read_all(tmp_path)] == ["a"]
+
+    # ... and the next append truncates it before writing.
+    append_entry(tmp_path, _metadata("b"))
+    append_entry(tmp_path, _metadata("c"))
+    assert [m["id"] for m in _read_all(tmp_path)] == ["a", "b", "c"]
+    assert path.read_bytes().count(b"DCM2") == 1
+
+
+def test_reader_resyncs_after_a_torn_entry_followed_by_more_entries(tmp_path):
+    # A writer that does not truncate (e.g. without flock) leaves the tear in place.
+    append_entry(tmp_path, _metadata("a"))
+    with (tmp_path / DAY_MANIFEST).open("ab") as f:
+        f.write(encode_entry(_metadata("torn", prompt="x" * 200_000))[:60])
+        f.write(encode_entry(_metadata("b")))
+        f.write(encode_entry(_metadata("c")))
+
+    assert [m["id"] for m in _read_all(tmp_path)] == ["a", "b", "c"]
+
+    # Appending after such damage keeps the intact entries behind it.
+    append_entry(tmp_path, _metadata("d"))
+    assert [m["id"] for m in _read_all(tmp_path)] == ["a", "b", "c", "d"]
+
+
+def test_reader_resyncs_after_damage_in_the_middle(tmp_path):
+    for rec_id in ("a", "b", "c"):
+        append_entry(tmp_path, _metadata(rec_id))
+    path = tmp_path / DAY_MANIFEST
+    data = bytearray(path.read_bytes())
+
+    with ManifestReader(path) as reader:
+        entries = list(reader.scan())
+    # Corrupt the middle entry's body and claim an absurd length for its first string.
+    middle = entries[1]
+    data[middle.offset + 12 + 25 : middle.offset + 12 + 29] = b"\xff\xff\xff\x7f"
+    path.write_bytes(bytes(data))
+
+    assert [m["id"] for m in _read_all(tmp_path)] == ["a", "c"]
+
+
+def test_foreign_file_is_ignored(tmp_path):
+    (tmp_path / DAY_MANIFEST).write_bytes(b"not a manifest")
+    with pytest.warns(UserWarning):
+        assert open_manifest(tmp_path) is None
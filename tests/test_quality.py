@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from src.metrics import quality
+
+
+def _images(n: int, size: int = 64, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # Smooth random images, so the low DCT frequencies carry real structure.
+    coarse = rng.integers(0, 256, size=(n, size // 8, size // 8, 3), dtype=np.uint8)
+    return coarse.repeat(8, axis=1).repeat(8, axis=2)
+
+
+def _phash_reference(image: np.ndarray) -> int:
+    # One image at a time, written out step by step.
+    gray = image.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    block = gray.shape[0] // 32
+    small = gray.reshape(32, block, 32, block).mean(axis=(1, 3))
+    n = 32
+    d = np.array(
+        [[np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n) for i in range(n)] for k in range(n)]
+    )
+    d[0] /= np.sqrt(2.0)
+    coeffs = (d @ small @ d.T)[:8, :8].ravel()
+    median = np.median(coeffs[1:])
+    value = 0
+    for bit in coeffs > median:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def test_phash_matches_reference():
+    batch = _images(4)
+    hashes = quality.phash(batch)
+    assert hashes.dtype == np.uint64
+    assert [int(h) for h in hashes] == [_phash_reference(img) for img in batch]
+
+
+def test_phash_ignores_brightness_and_separates_images():
+    batch = _images(2)
+    brighter = np.clip(batch.astype(np.int16) + 20, 0, 255).astype(np.uint8)
+    hashes = quality.phash(np.concatenate([batch, brighter]))
+    distances = quality.hamming(hashes, hashes)
+
+    assert distances[0, 2] <= 2  # same image, brighter
+    assert distances[0, 1] > 16  # unrelated images
+
+
+@pytest.mark.parametrize("native", [True, False])
+def test_hamming(monkeypatch, native):
+    if not native:
+        monkeypatch.delattr(np, "bitwise_count", raising=False)
+    a = np.array([0, 0xFF], dtype=np.uint64)
+    b = np.array([0, 1, 2**64 - 1, 0xF0F0], dtype=np.uint64)
+
+    expected = [[0, 1, 64, 8], [8, 7, 56, 8]]
+    assert quality.hamming(a, b).tolist() == expected
+
+
+def test_psnr():
+    black = np.zeros((3, 8, 8, 3), dtype=np.uint8)
+    off_by_one = black + 1
+    white = black + 255
+
+    assert quality.psnr(black, white) == pytest.approx([0.0] * 3)
+    assert quality.psnr(black, off_by_one) == pytest.approx([10 * np.log10(255.0**2)] * 3)
+    assert np.isinf(quality.psnr(black, black)).all()
+
+
+def _ssim_reference(a: np.ndarray, b: np.ndarray, win: int = 7) -> float:
+    x = quality.to_gray(a[None])[0].astype(np.float64)
+    y = quality.to_gray(b[None])[0].astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    values = []
+    for i in range(x.shape[0] - win + 1):
+        for j in range(x.shape[1] - win + 1):
+            wx, wy = x[i : i + win, j : j + win], y[i : i + win, j : j + win]
+            mx, my = wx.mean(), wy.mean()
+            vx, vy = wx.var(), wy.var()
+            cxy = ((wx - mx) * (wy - my)).mean()
+            values.append(((2 * mx * my + c1) * (2 * cxy + c2)) / ((mx**2 + my**2 + c1) * (vx + vy + c2)))
+    return float(np.mean(values))
+
+
+def test_ssim():
+    rng = np.random.default_rng(1)
+    a = rng.integers(0, 256, size=(2, 24, 24, 3), dtype=np.uint8)
+    noise = rng.integers(-30, 31, size=a.shape)
+    b = np.clip(a.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+    assert quality.ssim(a, a) == pytest.approx([1.0, 1.0])
+    values = quality.ssim(a, b)
+    assert values == pytest.approx([_ssim_reference(a[i], b[i]) for i in range(2)], rel=1e-6)
+    assert (values < 1.0).all()
+    assert quality.ssim(b, a) == pytest.approx(values)
+
+    # An unrelated image scores far lower than a noisy copy.
+    other = rng.integers(0, 256, size=a.shape, dtype=np.uint8)
+    assert (quality.ssim(a, other) < values - 0.5).all()
@@ -0,0 +1,122 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from src.storage.manifest import ManifestReader, append_entry
+from src.storage.watcher import GalleryWatcher
+
+DAY = "2026-01-01"
+
+
+def _metadata(day_dir: Path, rec_id: str, **extra):
+    return {
+        "id": rec_id,
+        "created_at": "2026-01-01T12:00:00",
+        "image_path": str(day_dir / f"{rec_id}.png"),
+        "prompt": f"a lighthouse {rec_id}",
+        "negative_prompt": "",
+        "preset_id": None,
+        "seed": 1,
+        "steps": 30,
+        "guidance_scale": 7.5,
+        "model_id": "runwayml/stable-diffusion-v1-5",
+        "device": "mps",
+        "duration_sec": 1.0,
+        **extra,
+    }
+
+
+def _png(day_dir: Path, rec_id: str) -> None:
+    Image.new("RGB", (8, 8)).save(day_dir / f"{rec_id}.png")
+
+
+def _sidecar(day_dir: Path, rec_id: str, **extra) -> None:
+    with (day_dir / f"{rec_id}.json").open("w", encoding="utf-8") as f:
+        json.dump(_metadata(day_dir, rec_id, **extra), f)
+
+
+@pytest.fixture
+def day_dir(tmp_path):
+    path = tmp_path / DAY
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    return GalleryWatcher(tmp_path, settle_sec=0.0, use_notifications=False)
+
+
+def _changes(events):
+    return sorted((e.kind, Path(e.key).stem) for e in events)
+
+
+def test_record_appears_once_both_halves_exist(day_dir, watcher):
+    _png(day_dir, "a")
+    _sidecar(day_dir, "b")
+
+    assert watcher.poll() == []
+    assert watcher.records() == []
+    assert watcher.orphans() == {DAY: ["a", "b"]}
+
+    _sidecar(day_dir, "a")
+    assert _changes(watcher.poll()) == [("added", "a")]
+    assert watcher.orphans() == {DAY: ["b"]}
+
+    (day_dir / "a.png").unlink()
+    assert _changes(watcher.poll()) == [("removed", "a")]
+    assert watcher.records() == []
+
+
+def test_partial_sidecar_is_retried(day_dir, watcher):
+    _png(day_dir, "a")
+    (day_dir / "a.json").write_text('{"id": "a", "prompt": ')  # writer still busy
+
+    assert watcher.poll() == []
+
+    # Completing the file in place does not touch the directory mtime; the
+    # failed parse alone must bring the watcher back.
+    _sidecar(day_dir, "a")
+    assert _changes(watcher.poll()) == [("added", "a")]
+    assert watcher.records()[0].prompt == "a lighthouse a"
+
+
+def test_updated_sidecar_is_reported(day_dir, watcher):
+    _png(day_dir, "a")
+    _sidecar(day_dir, "a")
+    watcher.poll()
+
+    # Replaced atomically, as the store writes sidecars.
+    tmp = day_dir / ".a.json.tmp"
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(_metadata(day_dir, "a", prompt="a lighthouse at dusk, longer prompt"), f)
+    os.replace(tmp, day_dir / "a.json")
+    assert _changes(watcher.poll()) == [("updated", "a")]
+    assert watcher.records()[0].prompt == "a lighthouse at dusk, longer prompt"
+
+
+def test_manifest_appends_are_read_incrementally(day_dir, watcher, monkeypatch):
+    starts = []
+    scan = ManifestReader.scan
+
+    def recording_scan(self, start=0):
+        starts.append(start)
+        return scan(self, start)
+
+    monkeypatch.setattr(ManifestReader, "scan", recording_scan)
+
+    append_entry(day_dir, _metadata(day_dir, "a"))
+    _png(day_dir, "a")
+    assert _changes(watcher.poll()) == [("added", "a")]
+    size_after_a = (day_dir / "records.manifest").stat().st_size
+
+    append_entry(day_dir, _metadata(day_dir, "b"))
+    _png(day_dir, "b")
+    assert _changes(watcher.poll()) == [("added", "b")]
+
+    # The second scan resumed where the first one stopped.
+    assert starts == [0, size_after_a]
+    assert sorted(r.id for r in watcher.records()) == ["a", "b"]